@@ -0,0 +1,67 @@
+import os
+import secrets
+import shutil
+import time
+from typing import Iterable, Optional, Tuple
+
+# Версионированный каталог артефактов: каждая версия модели лежит в ML_DIR/versions/<версия>,
+# а файл ML_DIR/CURRENT содержит имя активной версии. Версия публикуется заменой CURRENT
+# (os.replace), поэтому сервер никогда не видит наполовину записанный набор файлов.
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+
+# Файлы моделей "nn" и "rf", переносимые в новую версию из активной
+ARTIFACT_FILES = (
+    "neural_network_model_ai.h5",
+    "neural_network_model_ai.npz",
+    "label_encoder_ai.pkl",
+    "preprocessor_ai.pkl",
+    "model.pkl",
+    "label_encoder.pkl",
+    "preprocessor.pkl",
+)
+
+
+# Каталог активных артефактов и имя версии; без файла CURRENT артефакты лежат прямо в ml_dir (версия None)
+def resolve(ml_dir: str) -> Tuple[str, Optional[str]]:
+    try:
+        with open(os.path.join(ml_dir, CURRENT_FILE), encoding="utf-8") as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return ml_dir, None
+    if not version:
+        return ml_dir, None
+    return os.path.join(ml_dir, VERSIONS_DIR, version), version
+
+
+# Каталог новой версии с копиями файлов из source. Файлы копируются, а не связываются жёсткими
+# ссылками: перезапись файла в новой версии не должна менять уже опубликованную.
+def create_version(ml_dir: str, source: str, files: Iterable[str] = ARTIFACT_FILES) -> Tuple[str, str]:
+    version = f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}"
+    directory = os.path.join(ml_dir, VERSIONS_DIR, version)
+    os.makedirs(directory)
+    for name in files:
+        path = os.path.join(source, name)
+        if os.path.exists(path):
+            shutil.copy2(path, os.path.join(directory, name))
+    return directory, version
+
+
+def publish(ml_dir: str, version: str):
+    pointer = os.path.join(ml_dir, CURRENT_FILE)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    os.replace(pointer + ".tmp", pointer)
+
+
+# Удаляет старые версии, оставляя keep последних и активную. Серверы держат загруженную
+# модель в памяти, поэтому удаление каталога не мешает им дослужить запросы на старой версии.
+def prune(ml_dir: str, keep: int):
+    versions_dir = os.path.join(ml_dir, VERSIONS_DIR)
+    if not os.path.isdir(versions_dir):
+        return
+    _, current = resolve(ml_dir)
+    versions = sorted(name for name in os.listdir(versions_dir) if os.path.isdir(os.path.join(versions_dir, name)))
+    for name in versions[:max(0, len(versions) - keep)]:
+        if name != current:
+            shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
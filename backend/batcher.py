@@ -0,0 +1,125 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional
+from fastapi import HTTPException, status
+
+
+# Собирает одновременные запросы в пакеты размером не более max_batch_size,
+# ожидая пополнения пакета не дольше max_wait_ms, и выполняет один вызов
+# predict_batch на пакет. Пакеты выполняются в executor, одновременно не более
+# concurrency пакетов; очередь ограничена max_pending запросами.
+class InferenceBatcher:
+    def __init__(self, predict_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int, max_wait_ms: float,
+                 executor: Optional[Executor] = None, concurrency: int = 1, max_pending: int = 0):
+        self._predict_batch = predict_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._executor = executor
+        self.concurrency = max(1, concurrency)
+        self.max_pending = max(0, max_pending)
+        self._queue = None
+        self._task = None
+        self._inflight = set()
+        self._batches = 0
+        self._items = 0
+        self._max_batch = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._rejected = 0
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, item: Any) -> Any:
+        if self._task is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="AI inference queue is full. Please retry later.")
+        return await future
+
+    async def _collect(self) -> List[tuple]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            # Пока все исполнители заняты, запросы копятся в очереди и попадают в следующий пакет
+            await slots.acquire()
+            batch = await self._collect()
+            started = time.perf_counter()
+            self._record(len(batch), [started - queued_at for _, _, queued_at in batch])
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+    async def _dispatch(self, batch: List[tuple]):
+        try:
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(self._executor, self._predict_batch,
+                                                 [item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _record(self, size: int, waits: List[float]):
+        self._batches += 1
+        self._items += size
+        self._max_batch = max(self._max_batch, size)
+        self._wait_total += sum(waits)
+        self._wait_max = max(self._wait_max, max(waits))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self._batches,
+            "items": self._items,
+            "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+            "largest_batch": self._max_batch,
+            "avg_queue_wait_ms": self._wait_total / self._items * 1000 if self._items else 0.0,
+            "max_queue_wait_ms": self._wait_max * 1000,
+            "concurrency": self.concurrency,
+            "in_flight_batches": len(self._inflight),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "rejected": self._rejected,
+        }
@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import os
+import statistics
+import pickle
+import tempfile
+import threading
+import time
+import tracemalloc
+import httpx
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import sessionmaker
+
+AI_ITEM = {"properties": {"коллекция": "Коллекция Dust 2", "внешний вид": "прямо с завода",
+                          "категория": "сувенирный", "редкость": "тайное", "турнир": "IEM Katowice 2019"}}
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def report(name, latencies, elapsed):
+    print(f"{name}: {len(latencies)} req, {len(latencies) / elapsed:.1f} req/s, "
+          f"p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms, "
+          f"mean {statistics.fmean(latencies) * 1000 if latencies else 0.0:.1f} ms")
+
+
+async def _hammer(client, method, path, json, stop, latencies):
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.request(method, path, json=json)
+        if response.status_code < 500:
+            latencies.append(time.perf_counter() - started)
+
+
+async def _measure(client, path, duration, concurrency):
+    stop = asyncio.Event()
+    latencies = []
+    workers = [asyncio.create_task(_hammer(client, "GET", path, None, stop, latencies)) for _ in range(concurrency)]
+    await asyncio.sleep(duration)
+    stop.set()
+    await asyncio.gather(*workers)
+    return latencies
+
+
+# Нагрузочный тест: задержка CRUD-запросов без нагрузки и при насыщении /classify-ai
+async def load(args):
+    limits = httpx.Limits(max_connections=args.ai_clients + args.crud_clients + 10)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        baseline = await _measure(client, "/types", args.duration, args.crud_clients)
+        report("GET /types (idle)", baseline, args.duration)
+
+        stop = asyncio.Event()
+        ai_latencies = []
+        saturating = [
+            asyncio.create_task(_hammer(client, "POST", "/classify-ai", AI_ITEM, stop, ai_latencies))
+            for _ in range(args.ai_clients)
+        ]
+        await asyncio.sleep(1)
+        loaded = await _measure(client, "/types", args.duration, args.crud_clients)
+        stop.set()
+        await asyncio.gather(*saturating)
+
+        report("GET /types (AI saturated)", loaded, args.duration)
+        report("POST /classify-ai", ai_latencies, args.duration + 1)
+        print("batcher:", (await client.get("/classify-ai/stats")).json())
+
+
+# Синтетическая база знаний: types x properties, часть связей без значений
+def build_synthetic_knowledge(url, types, properties, engine=None):
+    import models
+    from database import Base
+
+    import knowledge
+
+    engine = engine or create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    knowledge.ensure_meta(engine)
+    type_names = [f"тип {i}" for i in range(types)]
+    property_names = [f"свойство {j}" for j in range(properties)]
+    with engine.begin() as connection:
+        connection.execute(models.Type.__table__.insert(), [{"name": name} for name in type_names])
+        connection.execute(models.Property.__table__.insert(), [{"name": name} for name in property_names])
+        connection.execute(models.PossibleValue.__table__.insert(), [
+            {"property_name": prop, "value": f"значение {k}"}
+            for j, prop in enumerate(property_names) if j % 10 for k in range(5)
+        ])
+        connection.execute(models.TypeProperty.__table__.insert(), [
+            {"type_name": type_name, "property_name": prop}
+            for type_name in type_names for prop in property_names
+        ])
+        type_ids = dict(connection.execute(select(models.Type.name, models.Type.id)).all())
+        property_ids = dict(connection.execute(select(models.Property.name, models.Property.id)).all())
+        connection.execute(models.PropertyValue.__table__.insert(), [
+            {"type_id": type_ids[type_name], "property_id": property_ids[prop], "value": value}
+            for i, type_name in enumerate(type_names) for j, prop in enumerate(property_names) if (i + j) % 10
+            for value in ("значение 1", "значение 2")
+        ])
+    return engine
+
+
+# Прежняя схема проверки полноты: запросы на каждый тип и каждое свойство типа
+def per_row_completeness(db):
+    import logic
+    import models
+
+    for type_obj in db.query(models.Type).all():
+        for prop_name in logic.get_type_properties(db, type_obj.id):
+            db_property = db.query(models.Property).filter(models.Property.name == prop_name).first()
+            logic.get_property_values(db, type_obj.id, db_property.id)
+    for property_obj in db.query(models.Property).all():
+        logic.get_possible_values(db, property_obj.name)
+
+
+def completeness(args):
+    import logic
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = build_synthetic_knowledge(f"sqlite:///{os.path.join(directory, 'bench.db')}",
+                                           args.types, args.properties)
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda *_: statements.append(1))
+        db = sessionmaker(bind=engine)()
+
+        runs = [("set-based check_completeness", logic.check_completeness)]
+        if not args.skip_per_row:
+            runs.append(("per-row queries", per_row_completeness))
+        for name, run in runs:
+            statements.clear()
+            started = time.perf_counter()
+            run(db)
+            print(f"{name}: {time.perf_counter() - started:.3f} s, {len(statements)} queries")
+        db.close()
+        engine.dispose()
+
+
+def _timed(predict, batches):
+    started = time.perf_counter()
+    for batch in batches:
+        predict(batch)
+    return (time.perf_counter() - started) / len(batches)
+
+
+def _peak_memory(predict, batch):
+    tracemalloc.start()
+    predict(batch)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+# Скомпилированный лес (forest_engine) против sklearn: совпадение вероятностей, задержка и память.
+# Прежний путь - Pipeline.predict и Pipeline.predict_proba по DataFrame на каждый запрос.
+def forest(args):
+    import joblib
+    import numpy as np
+    import pandas as pd
+    import artifacts
+    from feature_encoder import CompiledOneHotEncoder
+    from forest_engine import CompiledForest
+
+    directory, version = artifacts.resolve(args.ml_dir)
+    pipeline = joblib.load(os.path.join(directory, "model.pkl"))
+    classifier = pipeline.named_steps["classifier"]
+    encoder = CompiledOneHotEncoder.from_preprocessor(pipeline.named_steps["preprocessor"])
+    started = time.perf_counter()
+    compiled = CompiledForest.from_sklearn(classifier)
+    print(f"Compiled {len(classifier.estimators_)} trees, {len(compiled.feature)} nodes "
+          f"(version {version or 'unversioned'}) in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    rng = np.random.default_rng(0)
+    items = [
+        {feature: str(rng.choice(list(columns) + ["", "неизвестное значение"])) for feature, columns
+         in zip(encoder.features, encoder.columns)}
+        for _ in range(args.rows)
+    ]
+    frame = pd.DataFrame(items, columns=list(encoder.features))
+    X = encoder.encode_batch(items)
+
+    expected = pipeline.predict_proba(frame)
+    actual = compiled.predict(X)
+    max_diff = float(np.abs(expected - actual).max())
+    same_class = float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean())
+    print(f"Parity on {args.rows} rows: max |sklearn - compiled| = {max_diff:.2e}, same argmax: {same_class:.4f}")
+    if max_diff > args.atol:
+        raise SystemExit(f"Parity check failed (atol={args.atol})")
+
+    runs = [
+        ("sklearn pipeline", lambda rows: (pipeline.predict(frame.iloc[rows]), pipeline.predict_proba(frame.iloc[rows]))),
+        ("sklearn forest", lambda rows: classifier.predict_proba(X[rows])),
+        ("compiled forest", lambda rows: compiled.predict(X[rows])),
+    ]
+    singles = [slice(i % args.rows, i % args.rows + 1) for i in range(args.repeats)]
+    batches = [slice(0, args.batch_size)] * max(1, args.repeats // 10)
+    for name, predict in runs:
+        predict(singles[0])
+        single = _timed(predict, singles)
+        batched = _timed(predict, batches)
+        peak = _peak_memory(predict, batches[0])
+        print(f"{name}: single row {single * 1e3:.3f} ms, batch of {args.batch_size} {batched * 1e3:.3f} ms "
+              f"({batched / args.batch_size * 1e6:.1f} us/row), peak {peak / 2 ** 20:.1f} MB per batch")
+    print(f"Model size: sklearn forest {len(pickle.dumps(classifier)) / 2 ** 20:.1f} MB pickled, "
+          f"compiled arrays {compiled.nbytes / 2 ** 20:.1f} MB")
+
+
+def _mixed_worker(session_factory, type_ids, property_ids, write_ratio, seed, stop, stats):
+    import logic
+    import random
+    import schemas
+
+    rng = random.Random(seed)
+    db = session_factory()
+    counter = 0
+    while not stop.is_set():
+        type_id, property_id = rng.choice(type_ids), rng.choice(property_ids)
+        write = rng.random() < write_ratio
+        started = time.perf_counter()
+        try:
+            if write:
+                counter += 1
+                value = f"нагрузка {seed}-{counter}"
+                logic.create_property_value(db, type_id, property_id, schemas.PropertyValueCreate(values=[value]))
+                logic.delete_property_value(db, type_id, property_id, value)
+            else:
+                logic.get_property_values(db, type_id, property_id)
+                logic.get_type_properties(db, type_id)
+            db.commit()
+        except Exception:
+            db.rollback()
+            stats["errors"] += 1
+            continue
+        stats["writes" if write else "reads"].append(time.perf_counter() - started)
+    db.close()
+
+
+# Смешанная нагрузка чтение/запись на синтетической базе: прежний режим журнала против настроек из config
+def db_benchmark(args):
+    import config
+    import models
+    from database import build_engine
+    from sqlalchemy.orm import sessionmaker
+
+    modes = [("legacy (journal_mode=DELETE, synchronous=FULL)", "DELETE", "FULL"),
+             (f"configured (journal_mode={config.SQLITE_JOURNAL_MODE}, synchronous={config.SQLITE_SYNCHRONOUS})",
+              config.SQLITE_JOURNAL_MODE, config.SQLITE_SYNCHRONOUS)]
+    for name, journal_mode, synchronous in modes:
+        with tempfile.TemporaryDirectory() as directory:
+            url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+            engine = build_engine(url, journal_mode=journal_mode, synchronous=synchronous)
+            build_synthetic_knowledge(url, args.types, args.properties, engine=engine)
+            with engine.connect() as connection:
+                type_ids = [type_id for (type_id,) in connection.execute(select(models.Type.id))]
+                property_ids = [property_id for (property_id,) in connection.execute(select(models.Property.id))]
+            session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+            stop = threading.Event()
+            stats = {"reads": [], "writes": [], "errors": 0}
+            workers = [
+                threading.Thread(target=_mixed_worker,
+                                 args=(session_factory, type_ids, property_ids, args.write_ratio, seed, stop, stats))
+                for seed in range(args.threads)
+            ]
+            for worker in workers:
+                worker.start()
+            time.sleep(args.duration)
+            stop.set()
+            for worker in workers:
+                worker.join()
+            engine.dispose()
+
+        print(name)
+        report("  reads", stats["reads"], args.duration)
+        report("  writes", stats["writes"], args.duration)
+        print(f"  errors: {stats['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки сервера классификации")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load_parser = commands.add_parser("load", help="задержка CRUD при насыщенном /classify-ai")
+    load_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    load_parser.add_argument("--duration", type=float, default=10)
+    load_parser.add_argument("--ai-clients", type=int, default=64)
+    load_parser.add_argument("--crud-clients", type=int, default=4)
+    load_parser.set_defaults(handler=lambda args: asyncio.run(load(args)))
+
+    completeness_parser = commands.add_parser("completeness", help="проверка полноты на синтетической базе знаний")
+    completeness_parser.add_argument("--types", type=int, default=1000)
+    completeness_parser.add_argument("--properties", type=int, default=50)
+    completeness_parser.add_argument("--skip-per-row", action="store_true")
+    completeness_parser.set_defaults(handler=completeness)
+
+    db_parser = commands.add_parser("db", help="смешанная нагрузка чтение/запись на SQLite")
+    db_parser.add_argument("--types", type=int, default=200)
+    db_parser.add_argument("--properties", type=int, default=20)
+    db_parser.add_argument("--threads", type=int, default=16)
+    db_parser.add_argument("--write-ratio", type=float, default=0.2)
+    db_parser.add_argument("--duration", type=float, default=10)
+    db_parser.set_defaults(handler=db_benchmark)
+
+    forest_parser = commands.add_parser("forest", help="скомпилированный RandomForest против sklearn")
+    forest_parser.add_argument("--ml-dir", default="../ml")
+    forest_parser.add_argument("--rows", type=int, default=4096)
+    forest_parser.add_argument("--batch-size", type=int, default=64)
+    forest_parser.add_argument("--repeats", type=int, default=200)
+    forest_parser.add_argument("--atol", type=float, default=1e-5)
+    forest_parser.set_defaults(handler=forest)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
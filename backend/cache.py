@@ -0,0 +1,97 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+# Примерный размер ключа или значения в байтах: sys.getsizeof по всем вложенным строкам,
+# кортежам, спискам и словарям. Ключи и результаты содержат строки из запросов клиентов,
+# поэтому число записей само по себе память не ограничивает.
+def approximate_size(value: Any) -> int:
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(key) + approximate_size(item) for key, item in value.items())
+    elif isinstance(value, (tuple, list)):
+        size += sum(approximate_size(item) for item in value)
+    return size
+
+
+# Потокобезопасный LRU-кэш с ограничением по числу записей, по примерному объёму
+# ключей и значений (max_bytes=0 - без ограничения) и необязательным TTL
+class LRUCache:
+    def __init__(self, maxsize: int, ttl: Optional[float] = None, max_bytes: int = 0):
+        self.maxsize = max(0, maxsize)
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self.max_bytes = max(0, max_bytes)
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejected = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at, size = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        if not self.maxsize:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        size = approximate_size(key) + approximate_size(value) if self.max_bytes else 0
+        with self._lock:
+            # Запись больше всего бюджета не вытесняет остальные, а просто не кэшируется
+            if self.max_bytes and size > self.max_bytes:
+                self.rejected += 1
+                return
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            while len(self._data) > self.maxsize or (self.max_bytes and self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "rejected": self.rejected,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,268 @@
+import threading
+from collections import deque
+from typing import Dict, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+import config
+import knowledge
+import models
+
+
+# Состояние полноты базы знаний, поддерживаемое инкрементально хуками из logic.py.
+# Хук получает версию базы знаний, созданную его записью (knowledge.bump_version), и
+# применяется, только если она следует сразу за версией состояния. Запись, уже учтённая
+# загрузкой, пропускается, а пропуск версии (запись другого процесса сервера) помечает
+# состояние устаревшим, и оно перечитывается из БД при следующем запросе.
+class CompletenessState:
+    def __init__(self, log_size: int):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._version = 0
+        self._types: Dict[str, int] = {}
+        self._properties: Dict[str, int] = {}
+        self._possible_values: Dict[str, Set[int]] = {}
+        self._type_properties: Dict[str, Dict[int, str]] = {}
+        self._pairs_with_values: Set[Tuple[str, str]] = set()
+        self._incomplete_types: Dict[str, dict] = {}
+        self._properties_without_values: Set[str] = set()
+        self._report: Optional[dict] = None
+        self._log = deque(maxlen=log_size)
+        self._log_start = 0
+
+    # Заполняет состояние из БД; вызывается у нового экземпляра вне блокировки (см. _ensure_current)
+    def _load(self, db: Session):
+        while True:
+            version = knowledge.get_version(db)
+            types = {name: type_id for type_id, name in db.query(models.Type.id, models.Type.name)}
+            properties = {name: property_id for property_id, name in db.query(models.Property.id, models.Property.name)}
+            possible_values = {}
+            for value_id, property_name in db.query(models.PossibleValue.id, models.PossibleValue.property_name):
+                possible_values.setdefault(property_name, set()).add(value_id)
+            type_properties = {}
+            for tp_id, type_name, property_name in db.query(
+                    models.TypeProperty.id, models.TypeProperty.type_name, models.TypeProperty.property_name
+            ):
+                type_properties.setdefault(type_name, {})[tp_id] = property_name
+            pairs_with_values = set(
+                db.query(models.Type.name, models.Property.name)
+                .select_from(models.PropertyValue)
+                .join(models.Type, models.Type.id == models.PropertyValue.type_id)
+                .join(models.Property, models.Property.id == models.PropertyValue.property_id)
+                .distinct().all()
+            )
+            if knowledge.get_version(db) == version:
+                break
+
+        self._types = types
+        self._properties = properties
+        self._possible_values = possible_values
+        self._type_properties = type_properties
+        self._pairs_with_values = pairs_with_values
+        self._incomplete_types = {}
+        for type_name in types:
+            entry = self._type_entry(type_name)
+            if entry is not None:
+                self._incomplete_types[type_name] = entry
+        self._properties_without_values = {name for name in properties if not possible_values.get(name)}
+        self._version = version
+
+    # Подменяет поля состояния полями загруженного экземпляра: только присваивания ссылок
+    def _install(self, fresh: "CompletenessState"):
+        self._types = fresh._types
+        self._properties = fresh._properties
+        self._possible_values = fresh._possible_values
+        self._type_properties = fresh._type_properties
+        self._pairs_with_values = fresh._pairs_with_values
+        self._incomplete_types = fresh._incomplete_types
+        self._properties_without_values = fresh._properties_without_values
+        self._report = None
+        self._log.clear()
+        self._log_start = fresh._version
+        self._version = fresh._version
+        self._loaded = True
+
+    # Загружает состояние, если оно не загружено или отстаёт от версии в БД. Чтение таблиц
+    # идёт без блокировки: хуки записей, вызываемые из цикла событий, не ждут его окончания.
+    # Загруженное состояние подменяет текущее, только если оно новее.
+    def _ensure_current(self, db: Session):
+        version = knowledge.current_version(db)
+        with self._lock:
+            if self._loaded and self._version >= version:
+                return
+        fresh = CompletenessState(0)
+        fresh._load(db)
+        with self._lock:
+            if not self._loaded or fresh._version > self._version:
+                self._install(fresh)
+
+    def _advance(self, version: int) -> bool:
+        if not self._loaded or version <= self._version:
+            return False
+        if version != self._version + 1:
+            self._loaded = False
+            self._report = None
+            return False
+        self._version = version
+        return True
+
+    def _type_entry(self, type_name: str) -> Optional[dict]:
+        type_props = self._type_properties.get(type_name)
+        if not type_props:
+            return {"type": type_name, "reason": "нет свойств"}
+        missing_value_properties = [
+            prop_name for _, prop_name in sorted(type_props.items())
+            if (type_name, prop_name) not in self._pairs_with_values
+        ]
+        if missing_value_properties:
+            return {
+                "type": type_name,
+                "reason": "нет значений для следующих свойств",
+                "properties": missing_value_properties
+            }
+        return None
+
+    def _refresh_type(self, type_name: str):
+        old_entry = self._incomplete_types.get(type_name)
+        new_entry = self._type_entry(type_name) if type_name in self._types else None
+        if new_entry == old_entry:
+            return
+        if new_entry is None:
+            del self._incomplete_types[type_name]
+        else:
+            self._incomplete_types[type_name] = new_entry
+        self._record({"section": "incomplete_types", "type": type_name, "entry": new_entry})
+
+    def _refresh_property(self, property_name: str):
+        was_missing = property_name in self._properties_without_values
+        is_missing = property_name in self._properties and not self._possible_values.get(property_name)
+        if was_missing == is_missing:
+            return
+        if is_missing:
+            self._properties_without_values.add(property_name)
+        else:
+            self._properties_without_values.discard(property_name)
+        self._record({"section": "properties_without_values", "property": property_name, "missing": is_missing})
+
+    def _record(self, change: dict):
+        self._report = None
+        change["version"] = self._version
+        if len(self._log) == self._log.maxlen:
+            self._log_start = self._log[0]["version"]
+        self._log.append(change)
+
+    def report(self, db: Session) -> dict:
+        self._ensure_current(db)
+        with self._lock:
+            if self._report is None:
+                incomplete_types = sorted(self._incomplete_types.values(), key=lambda entry: self._types[entry["type"]])
+                properties_without_values = sorted(self._properties_without_values, key=self._properties.get)
+                if not self._types:
+                    incomplete_types.insert(0, {"type": "Нет типов", "reason": "типы не определены"})
+                if not self._properties:
+                    properties_without_values.insert(0, "Нет свойств")
+                self._report = {
+                    "incomplete_types": incomplete_types,
+                    "properties_without_values": properties_without_values,
+                }
+            return self._report
+
+    # Изменения с указанной версии; reset=True означает, что журнал не покрывает
+    # запрошенный интервал и отчёт нужно перечитать целиком.
+    def changes_since(self, db: Session, version: int) -> dict:
+        self._ensure_current(db)
+        with self._lock:
+            current = self._version
+            if version < self._log_start or version > current:
+                return {"version": current, "reset": True, "changes": []}
+            changes = [change for change in self._log if change["version"] > version]
+            return {"version": current, "reset": False, "changes": changes}
+
+    # Для записей, не меняющих полноту: версия состояния продвигается без изменений
+    def advance(self, version: int):
+        with self._lock:
+            self._advance(version)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+            self._report = None
+
+    def type_created(self, version: int, type_id: int, type_name: str):
+        with self._lock:
+            if self._advance(version):
+                self._types[type_name] = type_id
+                self._report = None
+                self._refresh_type(type_name)
+
+    def type_deleted(self, version: int, type_name: str):
+        with self._lock:
+            if self._advance(version):
+                self._types.pop(type_name, None)
+                self._report = None
+                self._type_properties.pop(type_name, None)
+                self._pairs_with_values = {pair for pair in self._pairs_with_values if pair[0] != type_name}
+                self._refresh_type(type_name)
+
+    def property_created(self, version: int, property_id: int, property_name: str):
+        with self._lock:
+            if self._advance(version):
+                self._properties[property_name] = property_id
+                self._report = None
+                self._refresh_property(property_name)
+
+    def property_deleted(self, version: int, property_name: str):
+        with self._lock:
+            if self._advance(version):
+                self._properties.pop(property_name, None)
+                self._report = None
+                self._possible_values.pop(property_name, None)
+                self._pairs_with_values = {pair for pair in self._pairs_with_values if pair[1] != property_name}
+                affected = []
+                for type_name, type_props in self._type_properties.items():
+                    removed = [tp_id for tp_id, prop_name in type_props.items() if prop_name == property_name]
+                    for tp_id in removed:
+                        del type_props[tp_id]
+                    if removed:
+                        affected.append(type_name)
+                for type_name in affected:
+                    self._refresh_type(type_name)
+                self._refresh_property(property_name)
+
+    def possible_value_created(self, version: int, property_name: str, value_id: int):
+        with self._lock:
+            if self._advance(version):
+                self._possible_values.setdefault(property_name, set()).add(value_id)
+                self._refresh_property(property_name)
+
+    def possible_value_deleted(self, version: int, property_name: str, value_id: int):
+        with self._lock:
+            if self._advance(version):
+                self._possible_values.get(property_name, set()).discard(value_id)
+                self._refresh_property(property_name)
+
+    def type_property_created(self, version: int, tp_id: int, type_name: str, property_name: str):
+        with self._lock:
+            if self._advance(version):
+                self._type_properties.setdefault(type_name, {})[tp_id] = property_name
+                self._refresh_type(type_name)
+
+    def type_property_deleted(self, version: int, tp_id: int, type_name: str):
+        with self._lock:
+            if self._advance(version):
+                self._type_properties.get(type_name, {}).pop(tp_id, None)
+                self._refresh_type(type_name)
+
+    def property_values_created(self, version: int, type_name: str, property_name: str):
+        with self._lock:
+            if self._advance(version):
+                self._pairs_with_values.add((type_name, property_name))
+                self._refresh_type(type_name)
+
+    # Вызывается, когда у пары (тип, свойство) удалено последнее значение
+    def property_values_deleted(self, version: int, type_name: str, property_name: str):
+        with self._lock:
+            if self._advance(version):
+                self._pairs_with_values.discard((type_name, property_name))
+                self._refresh_type(type_name)
+
+
+state = CompletenessState(config.COMPLETENESS_LOG_SIZE)
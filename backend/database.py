@@ -1,10 +1,92 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+import config
 
-DATABASE_URL = "sqlite:///./knowledge.db"
+DATABASE_URL = config.DATABASE_URL
 
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# Асинхронные драйверы для синхронных URL
+_ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "mysql": "aiomysql"}
+
+
+def async_url(url: str) -> str:
+    parsed = make_url(url)
+    driver = _ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        return url
+    return parsed.set(drivername=f"{parsed.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+
+def _apply_sqlite_pragmas(engine: Engine, journal_mode: str, synchronous: str):
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size={-config.SQLITE_CACHE_SIZE_KB}")
+        cursor.close()
+
+
+# Для SQLite включается WAL: читатели не блокируются пишущей транзакцией,
+# а synchronous=NORMAL убирает fsync на каждый коммит. Серверные СУБД получают пул с проверкой соединений.
+def _engine_options(url: str) -> dict:
+    parsed = make_url(url)
+    options = dict(
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+    )
+    if parsed.get_backend_name() != "sqlite":
+        options.update(pool_pre_ping=True, pool_recycle=config.DB_POOL_RECYCLE)
+    elif parsed.database in (None, "", ":memory:"):
+        options = {}
+    return options
+
+
+def build_engine(url: str = DATABASE_URL, journal_mode: str = config.SQLITE_JOURNAL_MODE,
+                 synchronous: str = config.SQLITE_SYNCHRONOUS) -> Engine:
+    if make_url(url).get_backend_name() != "sqlite":
+        return create_engine(url, **_engine_options(url))
+
+    engine = create_engine(url, connect_args={"check_same_thread": False}, **_engine_options(url))
+    _apply_sqlite_pragmas(engine, journal_mode, synchronous)
+    return engine
+
+
+# Асинхронный движок с теми же настройками пула и прагмами SQLite
+def build_async_engine(url: str = config.ASYNC_DATABASE_URL or async_url(DATABASE_URL)) -> AsyncEngine:
+    engine = create_async_engine(url, **_engine_options(url))
+    if make_url(url).get_backend_name() == "sqlite":
+        _apply_sqlite_pragmas(engine.sync_engine, config.SQLITE_JOURNAL_MODE, config.SQLITE_SYNCHRONOUS)
+    return engine
+
+
+# Транзакция только для чтения: все запросы внутри видят один снимок базы, поэтому правки
+# через API во время чтения не дают рассогласованного результата. pysqlite не открывает
+# транзакцию для SELECT, поэтому для SQLite BEGIN выдаётся явно, как в migrations.migrate.
+@contextmanager
+def read_transaction(engine: Engine):
+    if engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("BEGIN")
+            try:
+                yield connection
+            finally:
+                connection.exec_driver_sql("ROLLBACK")
+    else:
+        with engine.connect().execution_options(isolation_level="REPEATABLE READ") as connection:
+            with connection.begin():
+                yield connection
+
+
+engine = build_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Объекты остаются доступными после коммита: ответы сериализуются уже после выхода из run_sync
+async_engine = build_async_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
@@ -0,0 +1,19 @@
+import asyncio
+import functools
+from concurrent.futures import Executor, ThreadPoolExecutor
+import config
+
+# Отдельные пулы потоков, чтобы классификация не блокировала цикл событий
+# и не занимала общий пул потоков, обслуживающий CRUD-запросы.
+rule_executor = ThreadPoolExecutor(max_workers=config.RULE_WORKERS, thread_name_prefix="rule")
+ai_executor = ThreadPoolExecutor(max_workers=config.AI_WORKERS, thread_name_prefix="ai")
+
+
+async def run_in(executor: Executor, fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args))
+
+
+def shutdown():
+    rule_executor.shutdown(wait=False)
+    ai_executor.shutdown(wait=False)
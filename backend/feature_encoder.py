@@ -0,0 +1,62 @@
+from typing import Dict, List, Mapping, Optional, Sequence
+import numpy as np
+
+
+# Скомпилированный one-hot кодировщик: по категориям обученного OneHotEncoder
+# сопоставляет каждому значению признака номер столбца. Неизвестные значения
+# дают нулевой вектор признака, как при handle_unknown='ignore'.
+class CompiledOneHotEncoder:
+    def __init__(self, features: Sequence[str], categories: Sequence[Sequence[str]]):
+        self.features = tuple(features)
+        self.columns: List[Dict[str, int]] = []
+        offset = 0
+        for values in categories:
+            self.columns.append({value: offset + position for position, value in enumerate(values)})
+            offset += len(values)
+        self.width = offset
+
+    @classmethod
+    def from_preprocessor(cls, preprocessor) -> "CompiledOneHotEncoder":
+        features = []
+        categories = []
+        for name, transformer, columns in preprocessor.transformers_:
+            if name == "remainder":
+                if transformer != "drop" and len(columns):
+                    raise ValueError("Preprocessor passes through columns that are not one-hot encoded")
+                continue
+            if transformer.__class__.__name__ != "OneHotEncoder":
+                raise ValueError(f"Unsupported transformer '{name}': {transformer.__class__.__name__}")
+            if transformer.drop is not None or getattr(transformer, "_infrequent_enabled", False):
+                raise ValueError(f"Unsupported OneHotEncoder settings in '{name}'")
+            if transformer.handle_unknown not in ("ignore", "infrequent_if_exist"):
+                raise ValueError(f"OneHotEncoder '{name}' must ignore unknown categories")
+            features.extend(columns)
+            categories.extend([list(values) for values in transformer.categories_])
+        return cls(features, categories)
+
+    def indices(self, item_data: Mapping[str, str]) -> List[int]:
+        active = []
+        for feature, columns in zip(self.features, self.columns):
+            column = columns.get(item_data.get(feature, ""))
+            if column is not None:
+                active.append(column)
+        return active
+
+    def encode(self, item_data: Mapping[str, str], out: Optional[np.ndarray] = None) -> np.ndarray:
+        if out is None:
+            out = np.zeros(self.width, dtype=np.float32)
+        else:
+            out.fill(0)
+        out[self.indices(item_data)] = 1
+        return out
+
+    def encode_batch(self, items: Sequence[Mapping[str, str]]) -> np.ndarray:
+        encoded = np.zeros((len(items), self.width), dtype=np.float32)
+        rows = []
+        columns = []
+        for row, item_data in enumerate(items):
+            active = self.indices(item_data)
+            rows.extend([row] * len(active))
+            columns.extend(active)
+        encoded[rows, columns] = 1
+        return encoded
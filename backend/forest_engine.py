@@ -0,0 +1,95 @@
+import numpy as np
+
+
+# Лес RandomForestClassifier, скомпилированный в плоские массивы NumPy: узлы всех деревьев
+# лежат подряд, у листа feature = -1, а leaf - номер строки вероятностей классов в values.
+# Входы - one-hot признаки, и каждое разбиение (порог sklearn 0.5) сводится к вопросу
+# "активен ли признак", поэтому пакет обходится по булевой матрице активных признаков.
+class CompiledForest:
+    def __init__(self, roots, feature, children, leaf, values, input_dim):
+        self.roots = roots
+        self.feature = feature
+        self.children = children
+        self.leaf = leaf
+        self.values = values
+        self.input_dim = input_dim
+
+    @classmethod
+    def from_sklearn(cls, forest) -> "CompiledForest":
+        classes = np.asarray(forest.classes_)
+        if classes.dtype.kind not in "iu":
+            raise ValueError("Forest classes must be label-encoded integers")
+        output_dim = int(classes.max()) + 1
+        roots, features, children, leaves, values = [], [], [], [], []
+        nodes = leaf_count = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            if tree.n_outputs != 1:
+                raise ValueError("Multi-output forests are not supported")
+            is_leaf = tree.children_left < 0
+            thresholds = tree.threshold[~is_leaf]
+            if ((thresholds < 0) | (thresholds >= 1)).any():
+                raise ValueError("Forest splits on features that are not one-hot encoded")
+
+            roots.append(nodes)
+            features.append(np.where(is_leaf, -1, tree.feature))
+            children.append(np.where(is_leaf[:, None], -1,
+                                     np.column_stack([tree.children_left, tree.children_right]) + nodes))
+            leaf = np.full(tree.node_count, -1)
+            leaf[is_leaf] = leaf_count + np.arange(is_leaf.sum())
+            leaves.append(leaf)
+            # Вероятности листа, как в DecisionTreeClassifier.predict_proba: доли классов в листе
+            counts = tree.value[is_leaf, 0, :]
+            probabilities = np.zeros((len(counts), output_dim), dtype=np.float32)
+            probabilities[:, classes] = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1e-12)
+            values.append(probabilities)
+            nodes += tree.node_count
+            leaf_count += int(is_leaf.sum())
+
+        return cls(np.array(roots, dtype=np.int32),
+                   np.concatenate(features).astype(np.int32),
+                   np.concatenate(children).astype(np.int32),
+                   np.concatenate(leaves).astype(np.int32),
+                   np.concatenate(values),
+                   int(forest.n_features_in_))
+
+    @property
+    def output_dim(self) -> int:
+        return self.values.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self.roots, self.feature, self.children, self.leaf, self.values))
+
+    def _active(self, X) -> np.ndarray:
+        if hasattr(X, "tocsr"):
+            X = X.tocsr()
+            active = np.zeros(X.shape, dtype=bool)
+            active[np.repeat(np.arange(X.shape[0]), np.diff(X.indptr)), X.indices] = X.data != 0
+        else:
+            active = np.asarray(X) != 0
+        if active.ndim != 2 or active.shape[1] != self.input_dim:
+            raise ValueError(f"Expected input with {self.input_dim} features, got shape {active.shape}")
+        return active
+
+    # Сигнатура совместима с keras.Model.predict. Все пары (строка, дерево) спускаются
+    # одновременно: за шаг каждая ещё не дошедшая до листа пара переходит на уровень ниже,
+    # а дошедшие выбывают. Индексы плоские: children[2 * узел + активен ли признак].
+    def predict(self, X, verbose=0) -> np.ndarray:
+        active = self._active(X)
+        rows, trees = active.shape[0], len(self.roots)
+        active = active.ravel().view(np.int8)
+        children = self.children.ravel()
+        offsets = np.repeat(np.arange(rows, dtype=np.int64) * self.input_dim, trees)
+        nodes = np.tile(self.roots, rows)
+        pending = np.arange(len(nodes))
+        current = nodes.copy()
+        while pending.size:
+            feature = self.feature[current]
+            internal = feature >= 0
+            if not internal.all():
+                nodes[pending] = current
+                pending, current, feature, offsets = (
+                    pending[internal], current[internal], feature[internal], offsets[internal])
+            current = children[2 * current + active[offsets + feature]]
+        return self.values[self.leaf[nodes]].reshape(rows, trees, -1).mean(axis=1)
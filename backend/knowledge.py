@@ -0,0 +1,165 @@
+import threading
+import time
+import uuid
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import config
+import models
+from rule_index import RuleIndex, build_index
+
+
+# Неизменяемый снимок базы знаний, используемый на горячем пути классификации.
+# Строится один раз на версию базы знаний и подменяется целиком.
+class KnowledgeSnapshot(NamedTuple):
+    version: int
+    types: Tuple[Tuple[int, str], ...]
+    properties: frozenset
+    type_properties: Mapping[str, Tuple[str, ...]]
+    property_values: Mapping[Tuple[str, str], Tuple[str, ...]]
+    index: RuleIndex
+
+
+META_ID = 1
+_build_lock = threading.Lock()
+_snapshot: Optional[KnowledgeSnapshot] = None
+_version_lock = threading.Lock()
+_cached_meta: Optional[Tuple[str, int]] = None
+_cached_at = 0.0
+
+
+def _meta(db: Session) -> Tuple[str, int]:
+    row = db.query(models.KnowledgeMeta.epoch, models.KnowledgeMeta.version).filter(
+        models.KnowledgeMeta.id == META_ID
+    ).first()
+    return (row.epoch, row.version) if row is not None else ("", 0)
+
+
+# Версия хранится в БД (models.KnowledgeMeta): запись, выполненная одним процессом сервера,
+# видна остальным. get_version читает её из БД и нужна там, где важна точность (completeness._load).
+def get_version(db: Session) -> int:
+    return _meta(db)[1]
+
+
+# Версия в памяти процесса, которой пользуются горячие пути (снимок, ETag): из БД она читается
+# не чаще раза в KNOWLEDGE_VERSION_TTL секунд, а записи этого процесса обновляют её сразу после
+# коммита (_after_commit). Запись другого процесса становится видна не позже чем через TTL.
+def current_meta(db: Session) -> Tuple[str, int]:
+    meta = _cached_meta
+    if meta is not None and time.monotonic() - _cached_at < config.KNOWLEDGE_VERSION_TTL:
+        return meta
+    return _remember(*_meta(db), refreshed=True)
+
+
+def current_version(db: Session) -> int:
+    return current_meta(db)[1]
+
+
+def etag(db: Session) -> str:
+    epoch, version = current_meta(db)
+    return f'"kb-{epoch}-{version}"'
+
+
+# Версия в памяти только растёт: чтение из БД, начатое до коммита этого процесса, её не откатывает
+def _remember(epoch: str, version: int, refreshed: bool) -> Tuple[str, int]:
+    global _cached_meta, _cached_at
+    with _version_lock:
+        if _cached_meta is None or _cached_meta[0] != epoch or _cached_meta[1] < version:
+            _cached_meta = (epoch, version)
+        if refreshed:
+            _cached_at = time.monotonic()
+        return _cached_meta
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session):
+    version = session.info.pop("knowledge_version", None)
+    meta = _cached_meta
+    if version is not None and meta is not None:
+        _remember(meta[0], version, refreshed=False)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session: Session):
+    session.info.pop("knowledge_version", None)
+
+
+# Создаёт строку версии при старте сервера, если её ещё нет
+def ensure_meta(engine):
+    with Session(engine) as db:
+        if db.get(models.KnowledgeMeta, META_ID) is not None:
+            return
+        db.add(models.KnowledgeMeta(id=META_ID, epoch=uuid.uuid4().hex[:8], version=0))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+
+
+# Вызывается в транзакции каждой записи, изменяющей базу знаний, до коммита: версия
+# увеличивается атомарно вместе с данными. Возвращает новую версию; версия в памяти
+# процесса обновляется после коммита.
+def bump_version(db: Session) -> int:
+    db.flush()
+    updated = db.query(models.KnowledgeMeta).filter(models.KnowledgeMeta.id == META_ID).update(
+        {models.KnowledgeMeta.version: models.KnowledgeMeta.version + 1}, synchronize_session=False
+    )
+    if not updated:
+        db.add(models.KnowledgeMeta(id=META_ID, epoch=uuid.uuid4().hex[:8], version=1))
+        db.flush()
+    version = get_version(db)
+    db.info["knowledge_version"] = version
+    return version
+
+
+def _build_snapshot(db: Session, version: int) -> KnowledgeSnapshot:
+    types = tuple(
+        (type_id, name)
+        for type_id, name in db.query(models.Type.id, models.Type.name).order_by(models.Type.id)
+    )
+    properties = frozenset(name for (name,) in db.query(models.Property.name))
+
+    type_properties = {}
+    for type_name, property_name in db.query(
+            models.TypeProperty.type_name, models.TypeProperty.property_name
+    ).order_by(models.TypeProperty.id):
+        type_properties.setdefault(type_name, []).append(property_name)
+
+    property_values = {}
+    for type_name, property_name, value in db.query(
+            models.Type.name, models.Property.name, models.PropertyValue.value
+    ).select_from(models.PropertyValue).join(
+        models.Type, models.Type.id == models.PropertyValue.type_id
+    ).join(
+        models.Property, models.Property.id == models.PropertyValue.property_id
+    ).order_by(models.PropertyValue.id):
+        property_values.setdefault((type_name, property_name), []).append(value)
+
+    type_properties = {name: tuple(props) for name, props in type_properties.items()}
+    property_values = {pair: tuple(values) for pair, values in property_values.items()}
+
+    return KnowledgeSnapshot(
+        version=version,
+        types=types,
+        properties=properties,
+        type_properties=MappingProxyType(type_properties),
+        property_values=MappingProxyType(property_values),
+        index=build_index(types, properties, type_properties, property_values),
+    )
+
+
+def get_snapshot(db: Session) -> KnowledgeSnapshot:
+    global _snapshot
+    version = current_version(db)
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version >= version:
+        return snapshot
+
+    with _build_lock:
+        snapshot = _snapshot
+        if snapshot is None or snapshot.version < version:
+            snapshot = _build_snapshot(db, version)
+            _snapshot = snapshot
+    return snapshot
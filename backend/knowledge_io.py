@@ -0,0 +1,207 @@
+import json
+import time
+from itertools import groupby
+from typing import Iterable, Iterator, List, Optional, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+import completeness
+from database import read_transaction
+import knowledge
+import models
+import schemas
+
+# Размер порции строк при чтении из БД и примерный размер отдаваемого фрагмента ответа
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _unique(values: List[str]) -> List[str]:
+    return list(dict.fromkeys(values))
+
+
+# Ключи property_values имеют вид "<тип>_<свойство>"; так как имена могут содержать "_",
+# ключ сопоставляется с известными парами, а не делится по первому подчёркиванию.
+def _split_property_values_key(key: str, type_names, property_names, type_properties) -> Optional[Tuple[str, str]]:
+    candidates = []
+    for position, char in enumerate(key):
+        if char != "_":
+            continue
+        type_name, property_name = key[:position], key[position + 1:]
+        if type_name in type_names and property_name in property_names:
+            candidates.append((type_name, property_name))
+    for candidate in candidates:
+        if candidate[1] in type_properties.get(candidate[0], ()):
+            return candidate
+    return candidates[0] if candidates else None
+
+
+# Импорт базы знаний в формате knowledge.json одной транзакцией.
+# Уже существующие записи сохраняются, недостающие добавляются пакетными INSERT.
+def import_knowledge(db: Session, data: schemas.KnowledgeImport) -> dict:
+    started = time.perf_counter()
+
+    type_ids = dict(db.query(models.Type.name, models.Type.id))
+    property_ids = dict(db.query(models.Property.name, models.Property.id))
+    type_names = set(type_ids) | set(data.types)
+    property_names = set(property_ids) | set(data.properties)
+
+    for property_name in data.possible_values:
+        if property_name not in property_names:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Свойство '{property_name}' не найдено")
+    for type_name, props in data.type_properties.items():
+        if type_name not in type_names:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Тип '{type_name}' не найден")
+        for property_name in props:
+            if property_name not in property_names:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"Свойство '{property_name}' не найдено")
+
+    property_values = {}
+    for key, values in data.property_values.items():
+        pair = _split_property_values_key(key, type_names, property_names, data.type_properties)
+        if pair is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Не удалось сопоставить ключ '{key}' с типом и свойством")
+        property_values.setdefault(pair, []).extend(values)
+
+    validated = time.perf_counter()
+    created = {}
+    try:
+        new_types = [name for name in _unique(data.types) if name not in type_ids]
+        if new_types:
+            db.execute(insert(models.Type), [{"name": name} for name in new_types])
+            type_ids = dict(db.query(models.Type.name, models.Type.id))
+        created["types"] = len(new_types)
+
+        new_properties = [name for name in _unique(data.properties) if name not in property_ids]
+        if new_properties:
+            db.execute(insert(models.Property), [{"name": name} for name in new_properties])
+            property_ids = dict(db.query(models.Property.name, models.Property.id))
+        created["properties"] = len(new_properties)
+
+        existing = set(db.query(models.PossibleValue.property_name, models.PossibleValue.value))
+        rows = [
+            {"property_name": property_name, "value": value}
+            for property_name, values in data.possible_values.items() for value in _unique(values)
+            if (property_name, value) not in existing
+        ]
+        if rows:
+            db.execute(insert(models.PossibleValue), rows)
+        created["possible_values"] = len(rows)
+
+        existing = set(db.query(models.TypeProperty.type_name, models.TypeProperty.property_name))
+        rows = [
+            {"type_name": type_name, "property_name": property_name}
+            for type_name, props in data.type_properties.items() for property_name in _unique(props)
+            if (type_name, property_name) not in existing
+        ]
+        if rows:
+            db.execute(insert(models.TypeProperty), rows)
+        created["type_properties"] = len(rows)
+
+        existing = set(db.query(models.PropertyValue.type_id, models.PropertyValue.property_id,
+                                models.PropertyValue.value))
+        rows = [
+            {"type_id": type_ids[type_name], "property_id": property_ids[property_name], "value": value}
+            for (type_name, property_name), values in property_values.items() for value in _unique(values)
+            if (type_ids[type_name], property_ids[property_name], value) not in existing
+        ]
+        if rows:
+            db.execute(insert(models.PropertyValue), rows)
+        created["property_values"] = len(rows)
+
+        if any(created.values()):
+            knowledge.bump_version(db)
+        written = time.perf_counter()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    committed = time.perf_counter()
+
+    if any(created.values()):
+        completeness.state.invalidate()
+
+    return {
+        "created": created,
+        "timings_ms": {
+            "validate": round((validated - started) * 1000, 3),
+            "write": round((written - validated) * 1000, 3),
+            "commit": round((committed - written) * 1000, 3),
+            "total": round((committed - started) * 1000, 3),
+        },
+    }
+
+
+def _dump(value) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _stream_list(rows) -> Iterator[str]:
+    for position, (value,) in enumerate(rows):
+        yield ("" if position == 0 else ", ") + _dump(value)
+
+
+def _stream_mapping(rows, key_of) -> Iterator[str]:
+    for position, (key, group) in enumerate(groupby(rows, key=key_of)):
+        yield ("" if position == 0 else ", ") + f"{_dump(key)}: {_dump([row[-1] for row in group])}"
+
+
+def _chunked(pieces: Iterable[str]) -> Iterator[str]:
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def _rows(connection, statement):
+    return connection.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+
+def _export_pieces(connection) -> Iterator[str]:
+    yield '{"types": ['
+    yield from _stream_list(_rows(connection, select(models.Type.name).order_by(models.Type.id)))
+
+    yield '], "properties": ['
+    yield from _stream_list(_rows(connection, select(models.Property.name).order_by(models.Property.id)))
+
+    yield '], "possible_values": {'
+    rows = _rows(connection, select(models.PossibleValue.property_name, models.PossibleValue.value).order_by(
+        models.PossibleValue.property_name, models.PossibleValue.id
+    ))
+    yield from _stream_mapping(rows, lambda row: row[0])
+
+    yield '}, "type_properties": {'
+    rows = _rows(connection, select(models.TypeProperty.type_name, models.TypeProperty.property_name).order_by(
+        models.TypeProperty.type_name, models.TypeProperty.id
+    ))
+    yield from _stream_mapping(rows, lambda row: row[0])
+
+    yield '}, "property_values": {'
+    rows = _rows(connection, select(models.Type.name, models.Property.name, models.PropertyValue.value).select_from(
+        models.PropertyValue
+    ).join(
+        models.Type, models.Type.id == models.PropertyValue.type_id
+    ).join(
+        models.Property, models.Property.id == models.PropertyValue.property_id
+    ).order_by(
+        models.PropertyValue.type_id, models.PropertyValue.property_id, models.PropertyValue.id
+    ))
+    yield from _stream_mapping(rows, lambda row: f"{row[0]}_{row[1]}")
+    yield "}}"
+
+
+# Экспорт в формате knowledge.json по частям: строки читаются из БД порциями
+# и отдаются фрагментами, поэтому вся база знаний не собирается в памяти.
+# Все таблицы читаются в одной транзакции чтения, и запись во время экспорта не даёт
+# файла, в котором, например, значения ссылаются на ещё не выгруженный тип.
+def export_knowledge(engine) -> Iterator[str]:
+    with read_transaction(engine) as connection:
+        yield from _chunked(_export_pieces(connection))
@@ -1,8 +1,11 @@
 from sqlalchemy.orm import Session
 import models
 import schemas
+import knowledge
+import completeness
 from fastapi import HTTPException, status
 from typing import List
+from sqlalchemy import exists
 from sqlalchemy.exc import IntegrityError
 
 def get_types(db: Session) -> List[schemas.TypeOut]:
@@ -13,8 +16,10 @@ def create_type(db: Session, type_data: schemas.TypeCreate) -> schemas.TypeOut:
     try:
         db_type = models.Type(name=type_data.name)
         db.add(db_type)
+        version = knowledge.bump_version(db)
         db.commit()
         db.refresh(db_type)
+        completeness.state.type_created(version, db_type.id, db_type.name)
         return db_type
     except IntegrityError:
         db.rollback()
@@ -29,11 +34,14 @@ def delete_type(db: Session, type_id: int):
     if db_type is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Тип не найден")
 
+    type_name = db_type.name
     try:
         db.query(models.TypeProperty).filter(models.TypeProperty.type_name == db_type.name).delete()
-        db.query(models.PropertyValue).filter(models.PropertyValue.type_name == db_type.name).delete()
+        db.query(models.PropertyValue).filter(models.PropertyValue.type_id == db_type.id).delete()
         db.delete(db_type)
+        version = knowledge.bump_version(db)
         db.commit()
+        completeness.state.type_deleted(version, type_name)
         return {"message": "Тип удален"}
     except Exception as e:
         db.rollback()
@@ -48,8 +56,10 @@ def create_property(db: Session, property_data: schemas.PropertyCreate) -> schem
     try:
         db_property = models.Property(name=property_data.name)
         db.add(db_property)
+        version = knowledge.bump_version(db)
         db.commit()
         db.refresh(db_property)
+        completeness.state.property_created(version, db_property.id, db_property.name)
         return db_property
     except IntegrityError:
         db.rollback()
@@ -63,12 +73,15 @@ def delete_property(db: Session, property_id: int):
     db_property = db.query(models.Property).filter(models.Property.id == property_id).first()
     if db_property is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Свойство не найдено")
+    property_name = db_property.name
     try:
         db.query(models.PossibleValue).filter(models.PossibleValue.property_name == db_property.name).delete()
         db.query(models.TypeProperty).filter(models.TypeProperty.property_name == db_property.name).delete()
-        db.query(models.PropertyValue).filter(models.PropertyValue.property_name == db_property.name).delete()
+        db.query(models.PropertyValue).filter(models.PropertyValue.property_id == db_property.id).delete()
         db.delete(db_property)
+        version = knowledge.bump_version(db)
         db.commit()
+        completeness.state.property_deleted(version, property_name)
         return {"message": "Свойство удалено"}
     except Exception as e:
         db.rollback()
@@ -88,8 +101,10 @@ def create_possible_value(db: Session, property_name: str,
     try:
         db_value = models.PossibleValue(property_name=property_name, value=value_data.value)
         db.add(db_value)
+        version = knowledge.bump_version(db)
         db.commit()
         db.refresh(db_value)
+        completeness.state.possible_value_created(version, property_name, db_value.id)
         return db_value
     except IntegrityError:
         db.rollback()
@@ -108,8 +123,11 @@ def delete_possible_value(db: Session, property_name: str, value_name: str):
     if db_value is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Возможное значение не найдено")
 
+    value_id = db_value.id
     db.delete(db_value)
+    version = knowledge.bump_version(db)
     db.commit()
+    completeness.state.possible_value_deleted(version, property_name, value_id)
     return {"message": "Возможное значение удалено"}
 
 
@@ -131,8 +149,10 @@ def create_type_property(db: Session, type_id: int, property_name: str) -> schem
     try:
         db_type_property = models.TypeProperty(type_name=db_type.name, property_name=property_name)
         db.add(db_type_property)
+        version = knowledge.bump_version(db)
         db.commit()
         db.refresh(db_type_property)
+        completeness.state.type_property_created(version, db_type_property.id, db_type.name, property_name)
         return db_type_property
     except IntegrityError:
         db.rollback()
@@ -155,11 +175,37 @@ def delete_type_property(db: Session, type_id: int, property_name: str):
     if db_type_property is None:
         raise HTTPException(status_code=404, detail="Свойство типа не найдено")
 
+    type_property_id = db_type_property.id
     db.delete(db_type_property)
+    version = knowledge.bump_version(db)
     db.commit()
+    completeness.state.type_property_deleted(version, type_property_id, db_type.name)
     return {"message": "Свойство типа удалено"}
 
 
+# Значения пары (тип, свойство) хранятся построчно, а наружу отдаются одной записью со списком
+def _property_value_out(db: Session, db_type: models.Type, db_property: models.Property) -> List[schemas.PropertyValueOut]:
+    rows = db.query(models.PropertyValue.id, models.PropertyValue.value).filter(
+        models.PropertyValue.type_id == db_type.id,
+        models.PropertyValue.property_id == db_property.id
+    ).order_by(models.PropertyValue.id).all()
+    if not rows:
+        return []
+    return [schemas.PropertyValueOut(
+        id=rows[0].id,
+        type_name=db_type.name,
+        property_name=db_property.name,
+        values=[row.value for row in rows]
+    )]
+
+
+def _has_property_values(db: Session, type_id: int, property_id: int) -> bool:
+    return db.query(exists().where(
+        models.PropertyValue.type_id == type_id,
+        models.PropertyValue.property_id == property_id
+    )).scalar()
+
+
 def get_property_values(db: Session, type_id: int, property_id: int) -> List[schemas.PropertyValueOut]:
     db_type = db.query(models.Type).filter(models.Type.id == type_id).first()
     if db_type is None:
@@ -169,10 +215,7 @@ def get_property_values(db: Session, type_id: int, property_id: int) -> List[sch
     if db_property is None:
         raise HTTPException(status_code=404, detail="Свойство не найдено")
 
-    return db.query(models.PropertyValue).filter(
-        models.PropertyValue.type_name == db_type.name,
-        models.PropertyValue.property_name == db_property.name
-    ).all()
+    return _property_value_out(db, db_type, db_property)
 
 def create_property_value(db: Session, type_id: int, property_id: int, property_value_data: schemas.PropertyValueCreate) -> schemas.PropertyValueOut:
     db_type = db.query(models.Type).filter(models.Type.id == type_id).first()
@@ -183,42 +226,43 @@ def create_property_value(db: Session, type_id: int, property_id: int, property_
     if not db_property:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Свойство с идентификатором '{property_id}' не найдено")
 
-    existing_record = db.query(models.PropertyValue).filter(
-        models.PropertyValue.type_name == db_type.name,
-        models.PropertyValue.property_name == db_property.name
-    ).first()
+    new_values = list(dict.fromkeys(property_value_data.values))
+    if not new_values:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Не указано ни одного значения")
+
+    existing_values = {value for (value,) in db.query(models.PropertyValue.value).filter(
+        models.PropertyValue.type_id == db_type.id,
+        models.PropertyValue.property_id == db_property.id,
+        models.PropertyValue.value.in_(new_values)
+    )}
+    for value in new_values:
+        if value in existing_values:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Значение '{value}' уже существует для свойства '{db_property.name}' и типа '{db_type.name}'."
+            )
 
     try:
-        if existing_record:
-            new_values = property_value_data.values
-            for value in new_values:
-                if value in existing_record.values:
-                    raise HTTPException(
-                        status_code=status.HTTP_409_CONFLICT,
-                        detail=f"Значение '{value}' уже существует для свойства '{db_property.name}' и типа '{db_type.name}'."
-                    )
-            existing_record.values = existing_record.values + new_values
-            db.commit()
-            db.refresh(existing_record)
-            return existing_record
-        else:
-            db_property_value = models.PropertyValue(
-                type_name=db_type.name,
-                property_name=db_property.name,
-                values=property_value_data.values
-            )
-            db.add(db_property_value)
-            db.commit()
-            db.refresh(db_property_value)
-            return db_property_value
-    except HTTPException as e:
-        raise e
+        db.add_all([
+            models.PropertyValue(type_id=db_type.id, property_id=db_property.id, value=value)
+            for value in new_values
+        ])
+        version = knowledge.bump_version(db)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Одно из значений уже существует для свойства '{db_property.name}' и типа '{db_type.name}'."
+        )
     except Exception as e:
         db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e),
         )
+    completeness.state.property_values_created(version, db_type.name, db_property.name)
+    return _property_value_out(db, db_type, db_property)[0]
 
 
 
@@ -231,40 +275,57 @@ def delete_property_value(db: Session, type_id: int, property_id: int, value: st
     if not db_property:
         raise HTTPException(status_code=404, detail=f"Свойство с идентификатором {property_id} не найдено")
 
-    db_property_value = db.query(models.PropertyValue).filter(
-        models.PropertyValue.type_name == db_type.name,
-        models.PropertyValue.property_name == db_property.name
-    ).first()
+    deleted = db.query(models.PropertyValue).filter(
+        models.PropertyValue.type_id == db_type.id,
+        models.PropertyValue.property_id == db_property.id,
+        models.PropertyValue.value == value
+    ).delete()
 
-    if not db_property_value:
-        return {"message": f"Значения свойства не найдено для идентификатора типа {type_id} и идентификатора свойства  {property_id}"}
+    if not deleted:
+        db.rollback()
+        if not _has_property_values(db, db_type.id, db_property.id):
+            return {"message": f"Значения свойства не найдено для идентификатора типа {type_id} и идентификатора свойства  {property_id}"}
+        return {"message": f"Значение '{value}' не найдено из значения свойства"}
 
-    if value in db_property_value.values:
-        updated_values = list(db_property_value.values)
-        updated_values.remove(value)
-        db_property_value.values = updated_values
-        db.commit()
-        db.refresh(db_property_value)
-        return {"message": f"Значение '{value}' удалено из значения свойства"}
+    version = knowledge.bump_version(db)
+    db.commit()
+    if not _has_property_values(db, db_type.id, db_property.id):
+        completeness.state.property_values_deleted(version, db_type.name, db_property.name)
     else:
-        return {"message": f"Значение '{value}' не найдено из значения свойства"}
+        completeness.state.advance(version)
+    return {"message": f"Значение '{value}' удалено из значения свойства"}
 
 
+# Отчёт о полноте строится за постоянное число запросов, независимо от размера базы знаний
 def check_completeness(db: Session):
     results = {"incomplete_types": [], "properties_without_values": []}
 
-    all_types = db.query(models.Type).all()
-    all_properties = db.query(models.Property).all()
+    all_types = [name for (name,) in db.query(models.Type.name).order_by(models.Type.id)]
+
+    has_possible_values = exists().where(models.PossibleValue.property_name == models.Property.name)
+    all_properties = db.query(models.Property.name, has_possible_values).order_by(models.Property.id).all()
+    property_names = {name for name, _ in all_properties}
+
+    pairs_with_values = set(
+        db.query(models.Type.name, models.Property.name)
+        .select_from(models.PropertyValue)
+        .join(models.Type, models.Type.id == models.PropertyValue.type_id)
+        .join(models.Property, models.Property.id == models.PropertyValue.property_id)
+        .distinct().all()
+    )
+    type_properties = {}
+    for type_name, prop_name in db.query(
+            models.TypeProperty.type_name, models.TypeProperty.property_name
+    ).order_by(models.TypeProperty.id):
+        type_properties.setdefault(type_name, []).append((prop_name, (type_name, prop_name) in pairs_with_values))
 
     if not all_types:
         results["incomplete_types"].append({"type": "Нет типов", "reason": "типы не определены"})
     if not all_properties:
         results["properties_without_values"].append("Нет свойств")
 
-    for type_obj in all_types:
-        type_id = type_obj.id
-        type_name = type_obj.name
-        type_props = get_type_properties(db, type_id)
+    for type_name in all_types:
+        type_props = type_properties.get(type_name)
 
         if not type_props:
             results["incomplete_types"].append(
@@ -274,13 +335,11 @@ def check_completeness(db: Session):
 
         missing_value_properties = []
 
-        for prop_name in type_props:
-            db_property = db.query(models.Property).filter(models.Property.name == prop_name).first()
-            if not db_property:
+        for prop_name, prop_has_values in type_props:
+            if prop_name not in property_names:
                 raise HTTPException(status_code=500, detail=f"Internal Server Error: Свойство '{prop_name}' не найдено.")
 
-            prop_values = get_property_values(db, type_id, db_property.id)
-            if not prop_values:
+            if not prop_has_values:
                 missing_value_properties.append(prop_name)
 
         if missing_value_properties:
@@ -292,10 +351,8 @@ def check_completeness(db: Session):
                 }
             )
 
-    for property_obj in all_properties:
-        property_name = property_obj.name
-        possible_values = get_possible_values(db, property_name)
-        if not possible_values:
+    for property_name, property_has_values in all_properties:
+        if not property_has_values:
             results["properties_without_values"].append(property_name)
 
     return results
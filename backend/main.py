@@ -1,12 +1,22 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List
 import solver
 from typing import Dict
-from database import SessionLocal, engine, Base
+from database import SessionLocal, AsyncSessionLocal, engine, async_engine
+from sqlalchemy.ext.asyncio import AsyncSession
 import models
 import schemas
 import logic
+import knowledge
+import completeness
+import knowledge_io
+import migrations
+import config
+import executors
+import model_registry
+from batcher import InferenceBatcher
 from pydantic import BaseModel
 
 app = FastAPI()
@@ -22,8 +32,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# Синхронная сессия нужна классификации и отчёту о полноте: они работают в отдельных потоках
 def get_db():
     db = SessionLocal()
     try:
@@ -32,100 +44,203 @@ def get_db():
         db.close()
 
 
+# CRUD-эндпоинты вызывают функции logic.py через AsyncSession.run_sync, не занимая пул потоков
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# Условный GET для чтения базы знаний: версия берётся до запроса данных, поэтому ETag
+# никогда не оказывается новее отданных данных. Версия хранится в памяти процесса
+# (knowledge.current_meta), и ответ 304 обычно обходится без обращения к БД. Сессия та же,
+# что у эндпоинта: FastAPI создаёт зависимость get_async_db один раз на запрос.
+async def knowledge_etag(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    etag = await db.run_sync(knowledge.etag)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+        if "*" in candidates or etag in candidates:
+            raise HTTPException(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+
+ai_batcher = InferenceBatcher(solver.classify_items_ai, config.AI_BATCH_MAX_SIZE, config.AI_BATCH_MAX_WAIT_MS,
+                              executor=executors.ai_executor, concurrency=config.AI_WORKERS,
+                              max_pending=config.AI_MAX_PENDING)
+
+
+@app.on_event("startup")
+async def start_ai_batcher():
+    ai_batcher.start()
+    if config.ML_LOAD_MODE == "background":
+        model_registry.start_background_load()
+    model_registry.start_watcher(config.ML_WATCH_INTERVAL)
+
+
+@app.on_event("shutdown")
+async def stop_ai_batcher():
+    await ai_batcher.stop()
+    executors.shutdown()
+    await async_engine.dispose()
+
+
 class ItemData(BaseModel):
     properties: Dict[str, str]
 
 
 @app.post("/classify")
 async def classify(item_data: ItemData, db: SessionLocal = Depends(get_db)):
-    return solver.classify_item(db, item_data.properties)
+    return await executors.run_in(executors.rule_executor, solver.classify_item, db, item_data.properties)
+
+
+@app.post("/classify/batch")
+async def classify_batch(items: List[Dict[str, str]], db: SessionLocal = Depends(get_db)):
+    # Один запрос не должен надолго занимать пул классификации по правилам
+    if len(items) > config.CLASSIFY_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413,
+                            detail=f"Слишком много объектов в запросе: не более {config.CLASSIFY_BATCH_MAX_ITEMS}")
+    return await executors.run_in(executors.rule_executor, solver.classify_items, db, items)
+
+
+@app.get("/classify/stats")
+def classify_stats():
+    return {"cache": solver.rule_cache.stats()}
 
 
 @app.post("/classify-ai")
 async def classify_ai(item_data: ItemData):
-    return solver.classify_item_ai(item_data.properties)
+    solver.check_ai_available()
+    if solver.is_empty_ai_item(item_data.properties):
+        return solver.classify_item_ai(item_data.properties)
+    cached = solver.get_cached_ai_result(item_data.properties)
+    if cached is not None:
+        return cached
+    return await ai_batcher.submit(item_data.properties)
+
+
+@app.get("/classify-ai/stats")
+def classify_ai_stats():
+    return {"batcher": ai_batcher.stats(), "cache": solver.ai_cache.stats()}
+
+
+# Загрузка активной версии модели в фоне; до её готовности запросы обслуживает прежняя версия
+@app.post("/admin/model/reload", status_code=202)
+def reload_model():
+    if config.ML_BACKEND == "none":
+        raise HTTPException(status_code=409, detail="Классификация с помощью ИИ отключена")
+    if not model_registry.start_reload():
+        raise HTTPException(status_code=409, detail="Перезагрузка модели уже выполняется")
+    return model_registry.describe()
+
+
+@app.get("/ready")
+def readiness():
+    ready = model_registry.is_ready()
+    content = {"ready": ready, "degraded": model_registry.is_degraded(), "ml": model_registry.describe()}
+    return JSONResponse(content=content, status_code=200 if ready else 503)
 
 
-@app.get("/types", response_model=List[schemas.TypeOut])
-def read_types(db: SessionLocal = Depends(get_db)):
-    return logic.get_types(db)
+@app.get("/types", response_model=List[schemas.TypeOut], dependencies=[Depends(knowledge_etag)])
+async def read_types(db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.get_types)
 
 
 @app.post("/types", response_model=schemas.TypeOut)
-def create_new_type(type_data: schemas.TypeCreate, db: SessionLocal = Depends(get_db)):
-    return logic.create_type(db, type_data)
+async def create_new_type(type_data: schemas.TypeCreate, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.create_type, type_data)
 
 
 @app.delete("/types/{type_id}")
-def remove_type(type_id: int, db: SessionLocal = Depends(get_db)):
-    return logic.delete_type(db, type_id)
+async def remove_type(type_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.delete_type, type_id)
 
 
-@app.get("/properties", response_model=List[schemas.PropertyOut])
-def read_properties(db: SessionLocal = Depends(get_db)):
-    return logic.get_properties(db)
+@app.get("/properties", response_model=List[schemas.PropertyOut], dependencies=[Depends(knowledge_etag)])
+async def read_properties(db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.get_properties)
 
 
 @app.post("/properties", response_model=schemas.PropertyOut)
-def create_new_property(property_data: schemas.PropertyCreate, db: SessionLocal = Depends(get_db)):
-    return logic.create_property(db, property_data)
+async def create_new_property(property_data: schemas.PropertyCreate, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.create_property, property_data)
 
 
 @app.delete("/properties/{property_id}")
-def remove_property(property_id: int, db: SessionLocal = Depends(get_db)):
-    return logic.delete_property(db, property_id)
+async def remove_property(property_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.delete_property, property_id)
 
 
-@app.get("/possible-values/{property_name}", response_model=List[schemas.PossibleValueOut])
-def read_possible_values(property_name: str, db: SessionLocal = Depends(get_db)):
-    return logic.get_possible_values(db, property_name)
+@app.get("/possible-values/{property_name}", response_model=List[schemas.PossibleValueOut],
+         dependencies=[Depends(knowledge_etag)])
+async def read_possible_values(property_name: str, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.get_possible_values, property_name)
 
 
 @app.post("/possible-values/{property_name}", response_model=schemas.PossibleValueOut)
-def add_possible_value(property_name: str, value_data: schemas.PossibleValueBase, db: SessionLocal = Depends(get_db)):
-    return logic.create_possible_value(db, property_name, value_data)
+async def add_possible_value(property_name: str, value_data: schemas.PossibleValueBase,
+                             db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.create_possible_value, property_name, value_data)
 
 
 @app.delete("/possible-values/{property_name}/{value_name}")
-def remove_possible_value(property_name: str, value_name: str, db: SessionLocal = Depends(get_db)):
-    return logic.delete_possible_value(db, property_name, value_name)
+async def remove_possible_value(property_name: str, value_name: str, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.delete_possible_value, property_name, value_name)
 
 
-@app.get("/type-properties/{type_id}", response_model=List[str])
-def read_type_properties(type_id: int, db: SessionLocal = Depends(get_db)):
-    return logic.get_type_properties(db, type_id)
+@app.get("/type-properties/{type_id}", response_model=List[str], dependencies=[Depends(knowledge_etag)])
+async def read_type_properties(type_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.get_type_properties, type_id)
 
 
 @app.post("/type-properties/{type_id}", response_model=schemas.TypePropertyOut)
-def add_type_property(type_id: int, property_data: schemas.TypePropertyCreate,
-                      db: SessionLocal = Depends(get_db)):
-    return logic.create_type_property(db, type_id, property_data.property_name)
+async def add_type_property(type_id: int, property_data: schemas.TypePropertyCreate,
+                            db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.create_type_property, type_id, property_data.property_name)
 
 
 @app.delete("/type-properties/{type_id}/{property_name}")
-def remove_type_property(type_id: int, property_name: str, db: SessionLocal = Depends(get_db)):
-    return logic.delete_type_property(db, type_id, property_name)
+async def remove_type_property(type_id: int, property_name: str, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.delete_type_property, type_id, property_name)
 
 
 @app.get("/property-values/{type_id}/{property_id}", response_model=List[schemas.PropertyValueOut])
-def read_property_values(type_id: int, property_id: int, db: SessionLocal = Depends(get_db)):
-    return logic.get_property_values(db, type_id, property_id)
+async def read_property_values(type_id: int, property_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.get_property_values, type_id, property_id)
 
 
 @app.post("/property-values/{type_id}/{property_id}", response_model=schemas.PropertyValueOut)
-def add_property_value(type_id: int, property_id: int, property_value_data: schemas.PropertyValueCreate,
-                       db: SessionLocal = Depends(get_db)):
-    return logic.create_property_value(db, type_id, property_id, property_value_data)
+async def add_property_value(type_id: int, property_id: int, property_value_data: schemas.PropertyValueCreate,
+                             db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.create_property_value, type_id, property_id, property_value_data)
 
 
 @app.delete("/property-values/{type_id}/{property_id}/{value}")
-def remove_property_value(type_id: int, property_id: int, value: str, db: SessionLocal = Depends(get_db)):
-    return logic.delete_property_value(db, type_id, property_id, value)
+async def remove_property_value(type_id: int, property_id: int, value: str, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(logic.delete_property_value, type_id, property_id, value)
+
+
+# Импорт - долгая работа с разбором и проверкой данных на Python, поэтому обработчик синхронный
+# и выполняется в пуле потоков, а не через run_sync в цикле событий
+@app.post("/knowledge/import")
+def import_knowledge(data: schemas.KnowledgeImport, db: SessionLocal = Depends(get_db)):
+    return knowledge_io.import_knowledge(db, data)
+
+
+# Транзакция чтения открывается внутри генератора: она должна жить, пока ответ отдаётся по частям
+@app.get("/knowledge/export")
+def export_knowledge():
+    return StreamingResponse(knowledge_io.export_knowledge(engine), media_type="application/json")
 
 
 @app.get("/completeness-check")
 def perform_completeness_check(db: SessionLocal = Depends(get_db)):
-    return logic.check_completeness(db)
+    return completeness.state.report(db)
+
+
+@app.get("/completeness-check/changes")
+def read_completeness_changes(since: int, db: SessionLocal = Depends(get_db)):
+    return completeness.state.changes_since(db, since)
 
 
-Base.metadata.create_all(bind=engine)
+migrations.migrate(engine)
+knowledge.ensure_meta(engine)
@@ -0,0 +1,70 @@
+import json
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+import config
+import models
+
+# Сколько миграция ждёт, пока её выполняет другой процесс сервера (SQLite), в миллисекундах
+_LOCK_TIMEOUT_MS = 10 * 60 * 1000
+# Ключ транзакционной блокировки PostgreSQL, под которой выполняется миграция
+_ADVISORY_LOCK_ID = 7301
+
+
+# Перевод таблицы property_values из формата "JSON-список на пару (тип, свойство)"
+# в формат "одна строка на значение" с целочисленными внешними ключами.
+# Порядок значений сохраняется, повторы отбрасываются, записи одной пары объединяются.
+def _migrate_property_values(connection):
+    for index in inspect(connection).get_indexes("property_values"):
+        connection.exec_driver_sql(f'DROP INDEX "{index["name"]}"')
+    connection.exec_driver_sql("ALTER TABLE property_values RENAME TO property_values_legacy")
+    models.PropertyValue.__table__.create(connection)
+
+    rows = connection.exec_driver_sql(
+        'SELECT t.id, p.id, l."values" FROM property_values_legacy AS l '
+        "JOIN types AS t ON t.name = l.type_name "
+        "JOIN properties AS p ON p.name = l.property_name "
+        "ORDER BY l.id"
+    )
+    seen = set()
+    new_rows = []
+    for type_id, property_id, values in rows:
+        for value in json.loads(values) if values else ():
+            key = (type_id, property_id, value)
+            if key not in seen:
+                seen.add(key)
+                new_rows.append({"type_id": type_id, "property_id": property_id, "value": value})
+    if new_rows:
+        connection.execute(models.PropertyValue.__table__.insert(), new_rows)
+    connection.exec_driver_sql("DROP TABLE property_values_legacy")
+
+
+def _needs_property_values_migration(connection) -> bool:
+    inspector = inspect(connection)
+    if "property_values" not in inspector.get_table_names():
+        return False
+    return "values" in {column["name"] for column in inspector.get_columns("property_values")}
+
+
+# Вызывается при старте каждого процесса сервера: приводит схему к текущей и создаёт недостающие
+# таблицы. Проверки и изменения выполняются в одной пишущей транзакции (для SQLite - BEGIN IMMEDIATE):
+# если процессы стартуют одновременно, второй дождётся окончания первого и ничего не изменит.
+def migrate(engine: Engine):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        sqlite = engine.dialect.name == "sqlite"
+        if sqlite:
+            connection.exec_driver_sql(f"PRAGMA busy_timeout={_LOCK_TIMEOUT_MS}")
+        try:
+            connection.exec_driver_sql("BEGIN IMMEDIATE" if sqlite else "BEGIN")
+            if engine.dialect.name == "postgresql":
+                connection.exec_driver_sql(f"SELECT pg_advisory_xact_lock({_ADVISORY_LOCK_ID})")
+            try:
+                if _needs_property_values_migration(connection):
+                    _migrate_property_values(connection)
+                models.Base.metadata.create_all(bind=connection)
+            except Exception:
+                connection.exec_driver_sql("ROLLBACK")
+                raise
+            connection.exec_driver_sql("COMMIT")
+        finally:
+            if sqlite:
+                connection.exec_driver_sql(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
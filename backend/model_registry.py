@@ -0,0 +1,245 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional
+import joblib
+from fastapi import HTTPException, status
+import artifacts
+import config
+from feature_encoder import CompiledOneHotEncoder
+from forest_engine import CompiledForest
+
+NOT_LOADED = "not_loaded"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+DISABLED = "disabled"
+
+
+class LoadedModel(NamedTuple):
+    backend: str
+    version: str
+    model: object
+    label_encoder: object
+    encoder: CompiledOneHotEncoder
+
+
+# Версия артефактов вычисляется по именам, размерам и времени изменения файлов
+def _artifact_version(*paths: str) -> str:
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:12]
+
+
+def _load_nn(ml_dir: str) -> LoadedModel:
+    model_path = os.path.join(ml_dir, "neural_network_model_ai.npz")
+    if os.path.exists(model_path):
+        from nn_engine import NumpyMLP
+        model = NumpyMLP.load(model_path)
+    else:
+        from tensorflow.keras.models import load_model
+        model_path = os.path.join(ml_dir, "neural_network_model_ai.h5")
+        model = load_model(model_path)
+    label_encoder_path = os.path.join(ml_dir, "label_encoder_ai.pkl")
+    preprocessor_path = os.path.join(ml_dir, "preprocessor_ai.pkl")
+    label_encoder = joblib.load(label_encoder_path)
+    preprocessor = joblib.load(preprocessor_path)
+    return LoadedModel("nn", _artifact_version(model_path, label_encoder_path, preprocessor_path),
+                       model, label_encoder, CompiledOneHotEncoder.from_preprocessor(preprocessor))
+
+
+def _load_rf(ml_dir: str) -> LoadedModel:
+    model_path = os.path.join(ml_dir, "model.pkl")
+    label_encoder_path = os.path.join(ml_dir, "label_encoder.pkl")
+    pipeline = joblib.load(model_path)
+    label_encoder = joblib.load(label_encoder_path)
+    encoder = CompiledOneHotEncoder.from_preprocessor(pipeline.named_steps["preprocessor"])
+    # Лес компилируется в массивы (forest_engine), сам Pipeline после загрузки не хранится
+    model = CompiledForest.from_sklearn(pipeline.named_steps["classifier"])
+    return LoadedModel("rf", _artifact_version(model_path, label_encoder_path), model, label_encoder, encoder)
+
+
+_LOADERS = {
+    "nn": _load_nn,
+    "rf": _load_rf,
+}
+
+LOAD_MODES = ("background", "lazy")
+
+# Опечатка в настройках не должна молча оставлять сервер без модели: проверка при импорте
+if config.ML_BACKEND != "none" and config.ML_BACKEND not in _LOADERS:
+    raise ValueError(f"Unknown ML_BACKEND '{config.ML_BACKEND}', expected one of: none, {', '.join(_LOADERS)}")
+if config.ML_LOAD_MODE not in LOAD_MODES:
+    raise ValueError(f"Unknown ML_LOAD_MODE '{config.ML_LOAD_MODE}', expected one of: {', '.join(LOAD_MODES)}")
+
+
+# Пробный прогон на строке без признаков: первый вызов predict модели Keras строит граф, и это время
+# не должно приходиться на запросы. Заодно проверяется, что модель, кодировщик и классы согласованы.
+def _warm_up(loaded: LoadedModel):
+    probabilities = loaded.model.predict(loaded.encoder.encode_batch([{}]), verbose=0)
+    if probabilities.shape != (1, len(loaded.label_encoder.classes_)):
+        raise ValueError(f"Model output shape {probabilities.shape} does not match "
+                         f"{len(loaded.label_encoder.classes_)} classes of the label encoder")
+
+
+# Загрузка активной версии артефактов (artifacts.resolve); версия модели - имя каталога версии
+# или, для артефактов прямо в ML_DIR, хэш файлов
+def _load_current() -> LoadedModel:
+    loader = _LOADERS.get(config.ML_BACKEND)
+    if loader is None:
+        raise ValueError(f"Unknown ML_BACKEND '{config.ML_BACKEND}'")
+    directory, version = artifacts.resolve(config.ML_DIR)
+    loaded = loader(directory)
+    if version is not None:
+        loaded = loaded._replace(version=version)
+    _warm_up(loaded)
+    return loaded
+
+
+_lock = threading.Lock()
+_start_lock = threading.Lock()
+_reload_lock = threading.Lock()
+_loaded: Optional[LoadedModel] = None
+_status = DISABLED if config.ML_BACKEND == "none" else NOT_LOADED
+_error: Optional[str] = None
+_load_seconds: Optional[float] = None
+_reload_error: Optional[str] = None
+_reloads = 0
+_listeners: List[Callable[[LoadedModel], None]] = []
+
+
+# Обработчики вызываются после каждой успешной загрузки модели (например, для сброса кэшей)
+def on_load(listener: Callable[[LoadedModel], None]):
+    _listeners.append(listener)
+
+
+# Новая модель подменяет старую одним присваиванием. Запрос берёт модель через get() один раз
+# и работает с ней до конца, поэтому начатые запросы завершаются на прежней версии.
+def _activate(loaded: LoadedModel):
+    global _loaded, _status, _error
+    _loaded = loaded
+    _status, _error = READY, None
+    for listener in _listeners:
+        listener(loaded)
+
+
+def load() -> Optional[LoadedModel]:
+    global _status, _error, _load_seconds
+    with _lock:
+        if _status in (READY, DISABLED, FAILED):
+            return _loaded
+        _status = LOADING
+        started = time.perf_counter()
+        try:
+            _activate(_load_current())
+        except FileNotFoundError as e:
+            _status, _error = FAILED, str(e)
+            print("Warning: AI model or preprocessor not found. AI classification will be unavailable.")
+        except Exception as e:
+            _status, _error = FAILED, f"{type(e).__name__}: {e}"
+            print(f"ERROR: Failed to load AI model: {_error}")
+        _load_seconds = time.perf_counter() - started
+        return _loaded
+
+
+# Загрузка в отдельном потоке: импорт TensorFlow, чтение артефактов и прогрев не должны
+# занимать цикл событий. Статус LOADING выставляется сразу, поэтому поток запускается один раз.
+def start_background_load():
+    global _status
+    with _start_lock:
+        if _status != NOT_LOADED:
+            return
+        _status = LOADING
+    threading.Thread(target=load, name="ml-warmup", daemon=True).start()
+
+
+# Перезагрузка активной версии артефактов: пока новая модель загружается и прогревается,
+# запросы обслуживает прежняя. При ошибке прежняя модель остаётся активной.
+def reload() -> bool:
+    global _reload_error, _reloads, _load_seconds
+    if _status == DISABLED:
+        return False
+    with _reload_lock:
+        started = time.perf_counter()
+        try:
+            loaded = _load_current()
+        except Exception as e:
+            _reload_error = f"{type(e).__name__}: {e}"
+            print(f"ERROR: Failed to reload AI model: {_reload_error}")
+            return False
+        with _lock:
+            _activate(loaded)
+        _reload_error = None
+        _reloads += 1
+        _load_seconds = time.perf_counter() - started
+        print(f"AI model version {loaded.version} loaded in {_load_seconds:.2f} s")
+        return True
+
+
+# Запускает перезагрузку в фоне; False, если перезагрузка уже идёт
+def start_reload() -> bool:
+    if _status == DISABLED or _reload_lock.locked():
+        return False
+    threading.Thread(target=reload, name="ml-reload", daemon=True).start()
+    return True
+
+
+# Следит за файлом CURRENT и загружает новую версию, как только он начинает указывать на неё.
+# Версия, которую не удалось загрузить, повторно не загружается, пока CURRENT не изменится.
+def _watch(interval: float):
+    failed = None
+    while True:
+        time.sleep(interval)
+        if _status in (NOT_LOADED, LOADING):
+            continue
+        _, version = artifacts.resolve(config.ML_DIR)
+        if version is None or version == failed or (_loaded is not None and _loaded.version == version):
+            continue
+        failed = None if reload() else version
+
+
+def start_watcher(interval: float):
+    if _status != DISABLED and interval > 0:
+        threading.Thread(target=_watch, args=(interval,), name="ml-watcher", daemon=True).start()
+
+
+# В режиме lazy первый запрос запускает фоновую загрузку и, как и последующие до её окончания, получает 503
+def get() -> LoadedModel:
+    if _status == NOT_LOADED and config.ML_LOAD_MODE == "lazy":
+        start_background_load()
+    if _status == READY:
+        return _loaded
+    if _status in (NOT_LOADED, LOADING):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="AI model is still loading. Please retry later.")
+    raise HTTPException(status_code=500,
+                        detail="AI model or preprocessor is not available. Please check server logs.")
+
+
+# Модель, которую не удалось загрузить, не делает сервер неготовым, если она не обязательна (ML_REQUIRED)
+def is_ready() -> bool:
+    if _status == FAILED:
+        return not config.ML_REQUIRED
+    return _status in (READY, DISABLED)
+
+
+def is_degraded() -> bool:
+    return _status == FAILED
+
+
+def describe() -> dict:
+    return {
+        "backend": config.ML_BACKEND,
+        "load_mode": config.ML_LOAD_MODE,
+        "required": config.ML_REQUIRED,
+        "status": _status,
+        "version": _loaded.version if _loaded is not None else None,
+        "error": _error,
+        "load_seconds": _load_seconds,
+        "reloading": _reload_lock.locked(),
+        "reloads": _reloads,
+        "reload_error": _reload_error,
+    }
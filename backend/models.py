@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -32,11 +32,26 @@ class TypeProperty(Base):
     property = relationship("Property")
 
 
+# Одна строка на каждое допустимое значение свойства для типа;
+# уникальный индекс (type_id, property_id, value) обслуживает и поиск по паре (тип, свойство)
 class PropertyValue(Base):
     __tablename__ = "property_values"
+    __table_args__ = (
+        UniqueConstraint("type_id", "property_id", "value", name="uq_property_values_type_property_value"),
+        Index("ix_property_values_property_id", "property_id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    type_name = Column(String, ForeignKey("types.name"), index=True)
-    property_name = Column(String, ForeignKey("properties.name"), index=True)
-    values = Column(JSON)
+    type_id = Column(Integer, ForeignKey("types.id"), nullable=False)
+    property_id = Column(Integer, ForeignKey("properties.id"), nullable=False)
+    value = Column(String, nullable=False)
     type = relationship("Type")
     property = relationship("Property")
+
+
+# Версия базы знаний: увеличивается в той же транзакции, что и каждая запись, поэтому общая
+# для всех процессов сервера. epoch задаётся при создании строки и отличает пересозданную базу.
+class KnowledgeMeta(Base):
+    __tablename__ = "kb_meta"
+    id = Column(Integer, primary_key=True)
+    epoch = Column(String, nullable=False)
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,58 @@
+import numpy as np
+
+
+def _relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def _softmax(x):
+    x -= x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    return x
+
+
+_ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": _relu,
+    "softmax": _softmax,
+}
+
+
+# Прямой проход полносвязной сети на NumPy по весам, выгруженным из Keras
+# в формате .npz (см. ml/export_npz.py). Dropout на инференсе не действует.
+class NumpyMLP:
+    def __init__(self, layers):
+        self.layers = layers
+        for _, _, activation in layers:
+            if activation not in _ACTIVATIONS:
+                raise ValueError(f"Unsupported activation '{activation}'")
+
+    @classmethod
+    def load(cls, path: str) -> "NumpyMLP":
+        with np.load(path, allow_pickle=False) as data:
+            activations = [str(name) for name in data["activations"]]
+            layers = [
+                (np.ascontiguousarray(data[f"kernel_{i}"], dtype=np.float32),
+                 np.ascontiguousarray(data[f"bias_{i}"], dtype=np.float32),
+                 activation)
+                for i, activation in enumerate(activations)
+            ]
+        return cls(layers)
+
+    @property
+    def input_dim(self) -> int:
+        return self.layers[0][0].shape[0]
+
+    @property
+    def output_dim(self) -> int:
+        return self.layers[-1][0].shape[1]
+
+    # Сигнатура совместима с keras.Model.predict; X - плотная или разреженная матрица
+    def predict(self, X, verbose=0) -> np.ndarray:
+        for kernel, bias, activation in self.layers:
+            X = X @ kernel
+            X = np.asarray(X, dtype=np.float32)
+            X += bias
+            X = _ACTIVATIONS[activation](X)
+        return X
@@ -0,0 +1,96 @@
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+# Причины опровержения типа, возвращаемые RuleIndex.refutations
+NO_PROPERTIES = "no_properties"
+PROPERTY_NOT_DEFINED = "property_not_defined"
+VALUE_NOT_ALLOWED = "value_not_allowed"
+
+
+# Инвертированный индекс правил: каждому типу соответствует бит в целом числе,
+# а каждой паре (свойство, значение) - маска типов, для которых значение допустимо.
+class RuleIndex:
+    def __init__(self, type_names: Tuple[str, ...], with_properties: int,
+                 defined: Dict[str, int], unchecked: Dict[str, int],
+                 allowed: Dict[str, Dict[str, int]]):
+        self.type_names = type_names
+        self.with_properties = with_properties
+        self.defined = defined
+        self.unchecked = unchecked
+        self.allowed = allowed
+
+    def passing(self, property_name: str, value: str) -> int:
+        values = self.allowed.get(property_name)
+        allowed = values.get(value, 0) if values else 0
+        return self.unchecked.get(property_name, 0) | allowed
+
+    def match(self, item_data_lower: Mapping[str, str]) -> int:
+        suitable = self.with_properties
+        for property_name, value in item_data_lower.items():
+            if not suitable:
+                break
+            suitable &= self.passing(property_name, value)
+        return suitable
+
+    def suitable_types(self, mask: int) -> List[str]:
+        names = []
+        while mask:
+            low = mask & -mask
+            names.append(self.type_names[low.bit_length() - 1])
+            mask ^= low
+        return names
+
+    # Объяснения строятся только для опровергнутых типов и только по маскам.
+    def refutations(self, item_data_lower: Mapping[str, str],
+                    suitable: int) -> Iterator[Tuple[str, str, Optional[str], Optional[str]]]:
+        checks = [
+            (property_name, value, self.defined.get(property_name, 0), self.passing(property_name, value))
+            for property_name, value in item_data_lower.items()
+        ]
+        for position, type_name in enumerate(self.type_names):
+            bit = 1 << position
+            if not self.with_properties & bit:
+                yield type_name, NO_PROPERTIES, None, None
+                continue
+            if suitable & bit:
+                continue
+            for property_name, value, defined, passing in checks:
+                if not defined & bit:
+                    yield type_name, PROPERTY_NOT_DEFINED, property_name, value
+                elif not passing & bit:
+                    yield type_name, VALUE_NOT_ALLOWED, property_name, value
+
+
+def build_index(types: Tuple[Tuple[int, str], ...], properties: frozenset,
+                type_properties: Mapping[str, Tuple[str, ...]],
+                property_values: Mapping[Tuple[str, str], Tuple[str, ...]]) -> RuleIndex:
+    type_names = tuple(name for _, name in types)
+    with_properties = 0
+    defined = {}
+    unchecked = {}
+    allowed = {}
+
+    for position, type_name in enumerate(type_names):
+        bit = 1 << position
+        props = type_properties.get(type_name, ())
+        if not props:
+            continue
+        with_properties |= bit
+
+        # Для свойств, совпадающих без учёта регистра, используется первое из них
+        seen = set()
+        for prop in props:
+            prop_lower = prop.lower()
+            if prop_lower in seen:
+                continue
+            seen.add(prop_lower)
+            defined[prop_lower] = defined.get(prop_lower, 0) | bit
+
+            if prop not in properties:
+                unchecked[prop_lower] = unchecked.get(prop_lower, 0) | bit
+                continue
+
+            values = allowed.setdefault(prop_lower, {})
+            for value in property_values.get((type_name, prop), ()):
+                values[value] = values.get(value, 0) | bit
+
+    return RuleIndex(type_names, with_properties, defined, unchecked, allowed)
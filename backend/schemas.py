@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import Dict, List
 
 class TypeBase(BaseModel):
     name: str
@@ -67,4 +67,13 @@ class PropertyValueOut(PropertyValueBase):
     type_name: str
     property_name: str
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+
+# Формат ml/knowledge.json; ключи property_values имеют вид "<тип>_<свойство>"
+class KnowledgeImport(BaseModel):
+    types: List[str] = []
+    properties: List[str] = []
+    possible_values: Dict[str, List[str]] = {}
+    type_properties: Dict[str, List[str]] = {}
+    property_values: Dict[str, List[str]] = {}
@@ -1,92 +1,66 @@
 from sqlalchemy.orm import Session
-import models
-import logic
+import knowledge
+import rule_index
 from fastapi import HTTPException
-from typing import Dict
-import joblib
-import pandas as pd
-from tensorflow.keras.models import load_model
-
-try:
-
-    # Использование нейронной сети
-    model = load_model("../ml/neural_network_model_ai.h5")
-    label_encoder = joblib.load("../ml/label_encoder_ai.pkl")
-    preprocessor = joblib.load("../ml/preprocessor_ai.pkl")
-
-    # Использование ML
-    # model = joblib.load("../ml/model.pkl")
-    # label_encoder = joblib.load("../ml/label_encoder.pkl")
-    # preprocessor = joblib.load("../ml/preprocessor.pkl")
-
-except FileNotFoundError:
-    model = None
-    label_encoder = None
-    preprocessor = None
-    print("Warning: AI model or preprocessor not found. AI classification will be unavailable.")
-except Exception as e:
-    model = None
-    label_encoder = None
-    preprocessor = None
-    print(f"ERROR: Failed to load AI model: {type(e).__name__}: {e}")
+from typing import Dict, List, Optional
+import model_registry
+import config
+from cache import LRUCache
 
 
-def classify_item(db: Session, item_data: Dict[str, str]) -> Dict:
+def _refutation_message(type_name: str, reason: str, property_name: str, value: str) -> str:
+    if reason == rule_index.NO_PROPERTIES:
+        return f"Тип предмета '{type_name}' опровергнут, так как у него не определены свойства."
+    if reason == rule_index.PROPERTY_NOT_DEFINED:
+        return (f"Тип предмета '{type_name}' опровергнут, так как свойство '{property_name}' "
+                f"не определено для этого типа.")
+    return (f"Тип предмета '{type_name}' опровергнут, так как значение '{value}' "
+            f"свойства '{property_name}' не соответствует описанию типа предмета.")
 
-    all_types = logic.get_types(db)
-    if not all_types:
-        raise HTTPException(status_code=500, detail="Internal Server Error: No types defined.")
 
-    suitable_types = []
-    explanations = []
+# Кэш результатов по канонизированному набору свойств и версии базы знаний
+rule_cache = LRUCache(config.RULE_CACHE_SIZE, max_bytes=config.RULE_CACHE_MAX_BYTES)
+
 
-    item_data_lower = {key.lower(): value for key, value in item_data.items() if value.strip()}
+def _canonicalize(item_data: Dict[str, str]) -> Dict[str, str]:
+    return {key.lower(): value for key, value in item_data.items() if value.strip()}
 
-    for type_obj in all_types:
-        type_id = type_obj.id
-        type_name = type_obj.name
-        type_properties = logic.get_type_properties(db, type_id)
 
-        if not type_properties:
-            explanations.append(f"Тип предмета '{type_name}' опровергнут, так как у него не определены свойства.")
-            continue
+def classify_item(db: Session, item_data: Dict[str, str]) -> Dict:
+    return _classify_cached(_get_snapshot(db), item_data)
 
-        is_type_suitable = True
-        current_explanations = []
-        type_properties_lower = [prop.lower() for prop in type_properties]
 
-        for property_name, selected_value in item_data_lower.items():
+# Все элементы пакета классифицируются по одному снимку базы знаний
+def classify_items(db: Session, items: List[Dict[str, str]]) -> List[Dict]:
+    snapshot = _get_snapshot(db)
+    return [_classify_cached(snapshot, item_data) for item_data in items]
 
-            if property_name not in type_properties_lower:
-                is_type_suitable = False
-                current_explanations.append(
-                    f"Тип предмета '{type_name}' опровергнут, так как свойство '{property_name}' "
-                    f"не определено для этого типа."
-                )
-                continue
 
-            matching_prop = next((prop for prop in type_properties if prop.lower() == property_name), None)
-            if not matching_prop:
-                continue
+def _classify_cached(snapshot: knowledge.KnowledgeSnapshot, item_data: Dict[str, str]) -> Dict:
+    item_data_lower = _canonicalize(item_data)
+    key = (snapshot.version, tuple(item_data_lower.items()))
+    result = rule_cache.get(key)
+    if result is None:
+        result = _classify(snapshot, item_data_lower)
+        rule_cache.put(key, result)
+    return result
 
-            property_obj = db.query(models.Property).filter(models.Property.name == matching_prop).first()
-            if not property_obj:
-                continue
 
-            property_values = logic.get_property_values(db, type_id, property_obj.id)
-            allowed_values = property_values[0].values if property_values else []
+def _get_snapshot(db: Session) -> knowledge.KnowledgeSnapshot:
+    snapshot = knowledge.get_snapshot(db)
+    if not snapshot.types:
+        raise HTTPException(status_code=500, detail="Internal Server Error: No types defined.")
+    return snapshot
 
-            if selected_value not in allowed_values:
-                is_type_suitable = False
-                current_explanations.append(
-                    f"Тип предмета '{type_name}' опровергнут, так как значение '{selected_value}' "
-                    f"свойства '{property_name}' не соответствует описанию типа предмета."
-                )
 
-        if is_type_suitable:
-            suitable_types.append(type_name)
-        if current_explanations:
-            explanations.extend(current_explanations)
+def _classify(snapshot: knowledge.KnowledgeSnapshot, item_data_lower: Dict[str, str]) -> Dict:
+    index = snapshot.index
+    suitable = index.match(item_data_lower)
+    suitable_types = index.suitable_types(suitable)
+    explanations = [
+        _refutation_message(type_name, reason, property_name, value)
+        for type_name, reason, property_name, value in index.refutations(item_data_lower, suitable)
+    ]
 
     if suitable_types:
         result = {
@@ -105,79 +79,84 @@ def classify_item(db: Session, item_data: Dict[str, str]) -> Dict:
 
     return result
 
-# Предсказание с помощью ML
-# def classify_item_ai(item_data: Dict[str, str]) -> Dict:
-#     if model is None or label_encoder is None:
-#         raise HTTPException(status_code=500, detail="AI model is not available. Please check server logs.")
-#
-#     categorical_features = ['коллекция', 'внешний вид', 'категория', 'редкость', 'цвет', 'турнир']
-#     full_item_data = {feature: item_data.get(feature, "") for feature in categorical_features}
-#     input_df = pd.DataFrame([full_item_data])
-#
-#     try:
-#         predicted_class = model.predict(input_df)[0]
-#         predicted_type = label_encoder.inverse_transform([predicted_class])[0]
-#         probabilities = model.predict_proba(input_df)[0]
-#         prob_dict = {
-#             label_encoder.inverse_transform([i])[0]: float(prob)
-#             for i, prob in enumerate(probabilities)
-#         }
-#         explanation = [
-#             f"Модель ИИ предсказала тип '{predicted_type}' на основе введённых данных.",
-#             "Вероятности для каждого типа предмета приведены ниже."
-#         ]
-#         result = {
-#             "type": predicted_type,
-#             "explanation": explanation,
-#             "probabilities": prob_dict
-#         }
-#         return result
-#     except Exception as e:
-#         raise HTTPException(status_code=500, detail=f"Error during AI prediction: {str(e)}")
-
 # Предсказание с помощью ИИ
-def classify_item_ai(item_data: Dict[str, str]) -> Dict:
-    if model is None or label_encoder is None or preprocessor is None:
-        raise HTTPException(status_code=500,
-                            detail="AI model or preprocessor is not available. Please check server logs.")
+EMPTY_AI_RESULT = {
+    "type": "Не определён",
+    "explanation": [
+        "Все поля пустые. Введите данные для хотя бы одного свойства."
+    ],
+    "probabilities": {}
+}
 
-    categorical_features = ['коллекция', 'внешний вид', 'категория', 'редкость', 'цвет', 'турнир']
 
-    if not any(item_data.get(feature) for feature in categorical_features):
-        return {
-            "type": "Не определён",
-            "explanation": [
-                "Все поля пустые. Введите данные для хотя бы одного свойства."
-            ],
-            "probabilities": {}
-        }
+# Кэш предсказаний по нормализованному набору признаков и версии модели
+ai_cache = LRUCache(config.AI_CACHE_SIZE, config.AI_CACHE_TTL, config.AI_CACHE_MAX_BYTES)
+model_registry.on_load(lambda loaded: ai_cache.clear())
 
-    full_item_data = {feature: item_data.get(feature, "") for feature in categorical_features}
 
-    input_df = pd.DataFrame([full_item_data])
+def _ai_cache_key(loaded: model_registry.LoadedModel, item_data: Dict[str, str]) -> tuple:
+    return (loaded.version,) + tuple(item_data.get(feature) or "" for feature in loaded.encoder.features)
 
-    try:
-        processed_data = preprocessor.transform(input_df)
 
-        predicted_probabilities = model.predict(processed_data)[0]
-        predicted_class = predicted_probabilities.argmax()
-        predicted_type = label_encoder.inverse_transform([predicted_class])[0]
+def get_cached_ai_result(item_data: Dict[str, str]) -> Optional[Dict]:
+    return ai_cache.get(_ai_cache_key(model_registry.get(), item_data))
 
-        prob_dict = {
-            label_encoder.inverse_transform([i])[0]: float(predicted_probabilities[i])
-            for i in range(len(predicted_probabilities))
-        }
 
-        explanation = [
-            f"Модель ИИ предсказала тип '{predicted_type}' на основе введённых данных.",
-            "Вероятности для каждого типа предмета приведены ниже."
-        ]
+def check_ai_available():
+    model_registry.get()
 
-        result = {
-            "type": predicted_type,
-            "explanation": explanation,
-            "probabilities": prob_dict
-        }
-        return result
+
+# Признаки берутся из загруженного кодировщика: модель, обученная по базе знаний (ml/retrain.py),
+# может использовать другой набор свойств
+def is_empty_ai_item(item_data: Dict[str, str]) -> bool:
+    return not any(item_data.get(feature) for feature in model_registry.get().encoder.features)
+
+
+def classify_item_ai(item_data: Dict[str, str]) -> Dict:
+    loaded = model_registry.get()
+
+    if is_empty_ai_item(item_data):
+        return dict(EMPTY_AI_RESULT, model_version=loaded.version)
+
+    cached = get_cached_ai_result(item_data)
+    if cached is not None:
+        return cached
+    return classify_items_ai([item_data])[0]
+
+
+# Одно кодирование признаков и один вызов model.predict на весь пакет. Модель берётся один раз:
+# если во время обработки загрузится новая версия, пакет всё равно завершится на прежней
+def classify_items_ai(items: List[Dict[str, str]]) -> List[Dict]:
+    loaded = model_registry.get()
+    model, label_encoder = loaded.model, loaded.label_encoder
+
+    try:
+        processed_data = loaded.encoder.encode_batch(items)
+        predicted_batch = model.predict(processed_data, verbose=0)
+        class_names = label_encoder.inverse_transform(list(range(predicted_batch.shape[1])))
+
+        results = []
+        for item_data, predicted_probabilities in zip(items, predicted_batch):
+            predicted_type = class_names[predicted_probabilities.argmax()]
+
+            prob_dict = {
+                class_names[i]: float(predicted_probabilities[i])
+                for i in range(len(predicted_probabilities))
+            }
+
+            explanation = [
+                f"Модель ИИ предсказала тип '{predicted_type}' на основе введённых данных.",
+                "Вероятности для каждого типа предмета приведены ниже."
+            ]
+
+            result = {
+                "type": predicted_type,
+                "explanation": explanation,
+                "probabilities": prob_dict,
+                "model_version": loaded.version
+            }
+            ai_cache.put(_ai_cache_key(loaded, item_data), result)
+            results.append(result)
+        return results
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error during AI prediction: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error during AI prediction: {str(e)}")
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from sklearn.metrics import accuracy_score
+from gen_file import TARGET_COLUMN, generate_dataset
+import save_model
+
+KNOWLEDGE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge.json")
+
+
+def _timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+# База знаний с не более чем count значениями у каждого свойства: выборка из неё схлопывается
+# в компактном режиме до десятков различных строк, как у небольшой базы backend/knowledge.db.
+# На таких данных видно, зависит ли обучение от числа различных строк, а не повторений.
+def _few_values(knowledge_file, count, output_file):
+    with open(knowledge_file, encoding="utf-8") as f:
+        knowledge = json.load(f)
+    for section in ("possible_values", "property_values"):
+        knowledge[section] = {key: values[:count] for key, values in knowledge[section].items()}
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(knowledge, f, ensure_ascii=False)
+    return output_file
+
+
+# Сравнение полной и компактной (взвешенной) выборок: размер, время обучения
+# и точность на общей отложенной выборке, сгенерированной с другим seed.
+# Сравниваются две базы знаний: knowledge.json и её вариант с малым числом различных строк.
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение полного и компактного режимов обучающей выборки")
+    parser.add_argument("--samples-per-type", type=int, default=10000)
+    parser.add_argument("--test-samples-per-type", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--skip-nn", action="store_true", help="не обучать нейронную сеть")
+    parser.add_argument("--few-values", type=int, default=2,
+                        help="значений у свойства в базе знаний с малым числом различных строк")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cases = [
+            ("knowledge", KNOWLEDGE_FILE),
+            ("few-values", _few_values(KNOWLEDGE_FILE, args.few_values, os.path.join(directory, "few.json"))),
+        ]
+        rows = []
+        for case, knowledge_file in cases:
+            test_file = os.path.join(directory, f"{case}-test.csv")
+            generate_dataset(knowledge_file, args.test_samples_per_type, test_file, seed=args.seed + 1)
+            test = save_model.load_dataset(test_file)
+            X_test, y_test = test.drop(TARGET_COLUMN, axis=1), test[TARGET_COLUMN]
+
+            for mode in ("full", "compact"):
+                dataset_file = os.path.join(directory, f"{case}-{mode}.csv")
+                _, generate_seconds = _timed(generate_dataset, knowledge_file, args.samples_per_type, dataset_file,
+                                             seed=args.seed, mode=mode)
+                data, load_seconds = _timed(save_model.load_dataset, dataset_file)
+                row = {"case": case, "mode": mode, "rows": len(data),
+                       "size_mb": os.path.getsize(dataset_file) / 2 ** 20,
+                       "generate_s": generate_seconds, "load_s": load_seconds}
+
+                (model, label_encoder, _), row["rf_train_s"] = _timed(save_model.train, data, verbose=False)
+                row["rf_accuracy"] = accuracy_score(label_encoder.transform(y_test), model.predict(X_test))
+
+                if not args.skip_nn:
+                    import save_AI
+
+                    (nn_model, nn_label_encoder, preprocessor), row["nn_train_s"] = _timed(
+                        save_AI.train, data, epochs=args.epochs, verbose=False)
+                    predicted = nn_model.predict(preprocessor.transform(X_test), verbose=0).argmax(axis=1)
+                    row["nn_accuracy"] = accuracy_score(nn_label_encoder.transform(y_test), predicted)
+                rows.append(row)
+
+    columns = list(rows[0])
+    print(" | ".join(f"{column:>12}" for column in columns))
+    for row in rows:
+        print(" | ".join(f"{value:>12.4f}" if isinstance(value, float) else f"{value:>12}" for value in row.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from nn_engine import NumpyMLP
+
+
+# Выгрузка весов Dense-слоёв модели Keras в .npz для NumpyMLP
+def export_keras_model(model, path):
+    arrays = {}
+    activations = []
+    for layer in model.layers:
+        if layer.__class__.__name__ == "Dropout":
+            continue
+        if layer.__class__.__name__ != "Dense":
+            raise ValueError(f"Unsupported layer for NumPy export: {layer.__class__.__name__}")
+        kernel, bias = layer.get_weights()
+        index = len(activations)
+        arrays[f"kernel_{index}"] = kernel.astype(np.float32)
+        arrays[f"bias_{index}"] = bias.astype(np.float32)
+        activations.append(layer.get_config()["activation"])
+    np.savez_compressed(path, activations=np.array(activations), **arrays)
+
+
+def random_inputs(preprocessor, categorical_features, rows, seed=0):
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    encoder = preprocessor.named_transformers_["cat"]
+    frame = pd.DataFrame({
+        feature: rng.choice(np.append(categories.astype(object), "неизвестное значение"), size=rows)
+        for feature, categories in zip(categorical_features, encoder.categories_)
+    })
+    return preprocessor.transform(frame)
+
+
+def check_parity(keras_model, engine, X, atol):
+    expected = keras_model.predict(X, verbose=0)
+    actual = engine.predict(X)
+    max_diff = float(np.abs(expected - actual).max())
+    same_class = bool((expected.argmax(axis=1) == actual.argmax(axis=1)).all())
+    print(f"Parity: max |keras - numpy| = {max_diff:.2e}, same argmax: {same_class}")
+    if max_diff > atol or not same_class:
+        raise SystemExit(f"Parity check failed (atol={atol})")
+
+
+def benchmark(name, predict, X, repeats):
+    predict(X[:1])
+    started = time.perf_counter()
+    for i in range(repeats):
+        predict(X[i % X.shape[0]:i % X.shape[0] + 1])
+    single = (time.perf_counter() - started) / repeats
+
+    started = time.perf_counter()
+    for _ in range(max(1, repeats // 10)):
+        predict(X)
+    batched = (time.perf_counter() - started) / max(1, repeats // 10)
+    print(f"{name}: single row {single * 1e3:.3f} ms, batch of {X.shape[0]} {batched * 1e3:.3f} ms "
+          f"({batched / X.shape[0] * 1e6:.1f} us/row)")
+
+
+if __name__ == "__main__":
+    import joblib
+    from tensorflow.keras.models import load_model
+
+    parser = argparse.ArgumentParser(description="Экспорт модели Keras в .npz, проверка совпадения и бенчмарк")
+    parser.add_argument("--model", default="neural_network_model_ai.h5")
+    parser.add_argument("--preprocessor", default="preprocessor_ai.pkl")
+    parser.add_argument("--output", default="neural_network_model_ai.npz")
+    parser.add_argument("--rows", type=int, default=1024)
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--atol", type=float, default=1e-5)
+    args = parser.parse_args()
+
+    keras_model = load_model(args.model)
+    export_keras_model(keras_model, args.output)
+    engine = NumpyMLP.load(args.output)
+    print(f"Exported {args.model} -> {args.output} ({os.path.getsize(args.output)} bytes)")
+
+    preprocessor = joblib.load(args.preprocessor)
+    categorical_features = ['коллекция', 'внешний вид', 'категория', 'редкость', 'цвет', 'турнир']
+    X = random_inputs(preprocessor, categorical_features, args.rows)
+
+    check_parity(keras_model, engine, X, args.atol)
+    benchmark("keras", lambda batch: keras_model.predict(batch, verbose=0), X, args.repeats)
+    benchmark("numpy", engine.predict, X, args.repeats)
@@ -1,54 +1,239 @@
-import random
+import argparse
+import importlib.util
 import json
-import csv
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from typing import Dict, NamedTuple, Optional, Tuple
+import numpy as np
 
-def generate_dataset(knowledge_file, num_samples_per_type, output_file, output_format="csv"):
+TARGET_COLUMN = "тип_предмета"
+# Число повторений строки в компактном режиме; передаётся в обучение как sample_weight
+WEIGHT_COLUMN = "вес"
+CHUNK_SIZE = 10000
+MODES = ("full", "compact")
+
+
+def load_knowledge(knowledge_file):
     with open(knowledge_file, 'r', encoding='utf-8') as f:
-        knowledge = json.load(f)
+        return json.load(f)
+
 
-    types = knowledge["types"]
-    properties = knowledge["properties"]
+# Порция примеров одного типа по столбцам: свойство -> (допустимые значения, индексы выбранных значений).
+# weights задан только в компактном режиме: сколько раз строка встретилась в полной выборке.
+class Chunk(NamedTuple):
+    type_name: str
+    size: int
+    columns: Dict[str, Tuple[np.ndarray, np.ndarray]]
+    weights: Optional[np.ndarray] = None
+
+
+# Источник значений для каждого свойства типа выбирается один раз
+def resolve_sources(knowledge, type_name, warn=True):
     possible_values = knowledge["possible_values"]
-    type_properties = knowledge["type_properties"]
     property_values = knowledge["property_values"]
 
-    dataset = []
+    sources = []
+    for prop_name in knowledge["type_properties"][type_name]:
+        type_prop_key = f"{type_name}_{prop_name}"
+        if type_prop_key in property_values:
+            values = property_values[type_prop_key]
+        elif prop_name in possible_values:
+            if warn:
+                print(f"Warning: Использование возможных значений {type_name}.{prop_name}")
+            values = possible_values[prop_name]
+        else:
+            if warn:
+                print(f"Warning: Не найдено значений для {type_name}.{prop_name}.")
+            values = []
+        sources.append((prop_name, np.array(values or [""], dtype=object)))
+    return sources
+
 
-    for type_name in types:
-        if type_name not in type_properties:
+# Блок (тип, номер порции) получает собственный seed, производный от общего, поэтому
+# результат не зависит от числа процессов и порядка выполнения блоков.
+def _sample_block(task):
+    type_name, sources, size, entropy, spawn_key = task
+    rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=spawn_key))
+    columns = {prop_name: (values, rng.integers(len(values), size=size)) for prop_name, values in sources}
+    return Chunk(type_name, size, columns)
+
+
+def iter_tasks(knowledge, num_samples_per_type, chunk_size, seed):
+    entropy = np.random.SeedSequence(seed).entropy
+    for type_index, type_name in enumerate(knowledge["types"]):
+        if type_name not in knowledge["type_properties"]:
             print(f"Warning: Свойства не определены для типа '{type_name}'.")
             continue
+        sources = resolve_sources(knowledge, type_name)
+        for block_index, start in enumerate(range(0, num_samples_per_type, chunk_size)):
+            size = min(chunk_size, num_samples_per_type - start)
+            yield type_name, sources, size, entropy, (type_index, block_index)
+
+
+# Каждое значение выбирается равновероятно и независимо, как и прежде, но целым столбцом за вызов.
+# При workers > 1 блоки считаются в пуле процессов; в обработке одновременно не больше 2 * workers блоков,
+# и порции отдаются в исходном порядке, поэтому память не зависит от num_samples_per_type.
+def iter_chunks(knowledge, num_samples_per_type, chunk_size=CHUNK_SIZE, seed=None, workers=1):
+    tasks = iter_tasks(knowledge, num_samples_per_type, chunk_size, seed)
+    if workers <= 1:
+        yield from map(_sample_block, tasks)
+        return
+
+    with ProcessPoolExecutor(workers) as executor:
+        pending = []
+        for task in tasks:
+            pending.append(executor.submit(_sample_block, task))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+# Компактный режим: те же блоки, что и в полном режиме, но одинаковые строки типа
+# сворачиваются в одну с числом повторений. При тех же seed и chunk_size это ровно
+# агрегат полной выборки, а размер зависит от числа различных строк, а не от num_samples_per_type.
+def iter_compact_chunks(knowledge, num_samples_per_type, chunk_size=CHUNK_SIZE, seed=None, workers=1):
+    chunks = iter_chunks(knowledge, num_samples_per_type, chunk_size, seed, workers)
+    for type_name, type_chunks in groupby(chunks, key=lambda chunk: chunk.type_name):
+        keys = np.zeros(0, dtype=np.int64)
+        counts = np.zeros(0, dtype=np.int64)
+        for chunk in type_chunks:
+            tables = [values for values, _ in chunk.columns.values()]
+            sizes = [len(values) for values in tables]
+            codes = [codes for _, codes in chunk.columns.values()]
+            flat = np.ravel_multi_index(codes, sizes) if codes else np.zeros(chunk.size, dtype=np.int64)
+            keys, inverse = np.unique(np.concatenate([keys, flat]), return_inverse=True)
+            counts = np.bincount(inverse, weights=np.concatenate([counts, np.ones(chunk.size)])).astype(np.int64)
+
+        for start in range(0, len(keys), chunk_size):
+            part = keys[start:start + chunk_size]
+            codes = np.unravel_index(part, sizes) if sizes else ()
+            columns = {prop_name: (values, column_codes)
+                       for prop_name, values, column_codes in zip(chunk.columns, tables, codes)}
+            yield Chunk(type_name, len(part), columns, counts[start:start + chunk_size])
+
+
+def dataset_columns(knowledge, mode="full"):
+    return knowledge["properties"] + [TARGET_COLUMN] + ([WEIGHT_COLUMN] if mode == "compact" else [])
+
+
+def iter_dataset_chunks(knowledge, num_samples_per_type, chunk_size=CHUNK_SIZE, seed=None, workers=1, mode="full"):
+    sample = iter_compact_chunks if mode == "compact" else iter_chunks
+    return sample(knowledge, num_samples_per_type, chunk_size, seed, workers)
+
+
+def _encoded(chunk, column):
+    if column == TARGET_COLUMN:
+        return np.array([chunk.type_name], dtype=object), np.zeros(chunk.size, dtype=np.int64)
+    if column == WEIGHT_COLUMN:
+        return np.array(chunk.weights.tolist(), dtype=object), np.arange(chunk.size)
+    return chunk.columns.get(column) or (np.array([""], dtype=object), np.zeros(chunk.size, dtype=np.int64))
+
+
+# Строки порции собираются сложением столбцов уже отформатированных фрагментов:
+# каждое допустимое значение форматируется один раз, а не в каждой строке.
+def _format_chunk(chunk, columns, format_fragment, prefix, suffix):
+    lines = np.full(chunk.size, prefix, dtype=object)
+    last = len(columns) - 1
+    for position, column in enumerate(columns):
+        values, codes = _encoded(chunk, column)
+        fragments = np.array([format_fragment(column, value, position == last) for value in values], dtype=object)
+        lines += fragments[codes]
+    lines += suffix
+    return lines.tolist()
+
+
+def _record_columns(chunk):
+    return list(chunk.columns) + [TARGET_COLUMN] + ([] if chunk.weights is None else [WEIGHT_COLUMN])
 
-        for _ in range(num_samples_per_type):
-            sample = {}
-            for prop_name in type_properties[type_name]:
-                type_prop_key = f"{type_name}_{prop_name}"
-
-                if type_prop_key in property_values:
-                    allowed_values = property_values[type_prop_key]
-                    sample[prop_name] = random.choice(allowed_values)
-                elif prop_name in possible_values:
-                    print(f"Warning: Использование возможных значений {type_name}.{prop_name}")
-                    sample[prop_name] = random.choice(possible_values[prop_name])
-                else:
-                    print(f"Warning: Не найдено значений для {type_name}.{prop_name}.")
-                    sample[prop_name] = ""  # Или None
-
-            sample["тип_предмета"] = type_name
-            dataset.append(sample)
-
-    if output_format == "csv":
-        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = properties + ["тип_предмета"]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(dataset)
-    elif output_format == "json":
-        with open(output_file, 'w', encoding='utf-8') as jsonfile:
-            json.dump(dataset, jsonfile, indent=4, ensure_ascii=False)
-    else:
+
+def _csv_field(value):
+    if any(char in value for char in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def write_csv(chunks, output_file, columns):
+    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+        csvfile.write(",".join(map(_csv_field, columns)) + "\r\n")
+        for chunk in chunks:
+            csvfile.write("".join(_format_chunk(
+                chunk, columns, lambda column, value, last: _csv_field(str(value)) + ("" if last else ","), "", "\r\n")))
+
+
+def _json_field(column, value, indent, separator, last):
+    field = f"{json.dumps(column, ensure_ascii=False)}: {json.dumps(value, ensure_ascii=False)}"
+    return indent + field + ("" if last else separator)
+
+
+def write_json(chunks, output_file, columns):
+    with open(output_file, 'w', encoding='utf-8') as jsonfile:
+        jsonfile.write("[")
+        separator = "\n"
+        for chunk in chunks:
+            records = _format_chunk(chunk, _record_columns(chunk), lambda column, value, last: _json_field(
+                column, value, "        ", ",", last) + "\n", "    {\n", "    }")
+            jsonfile.write(separator + ",\n".join(records))
+            separator = ",\n"
+        jsonfile.write("\n]\n" if separator == ",\n" else "]\n")
+
+
+def write_jsonl(chunks, output_file, columns):
+    with open(output_file, 'w', encoding='utf-8') as jsonlfile:
+        for chunk in chunks:
+            jsonlfile.write("".join(_format_chunk(chunk, _record_columns(chunk), lambda column, value, last: _json_field(
+                column, value, "", ", ", last), "{", "}\n")))
+
+
+# Parquet пишется группами строк по одной на порцию; нужен pyarrow
+def write_parquet(chunks, output_file, columns):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(column, pa.int64() if column == WEIGHT_COLUMN else pa.string()) for column in columns])
+    with pq.ParquetWriter(output_file, schema) as writer:
+        for chunk in chunks:
+            arrays = [
+                pa.array(chunk.weights, pa.int64()) if column == WEIGHT_COLUMN else
+                pa.DictionaryArray.from_arrays(codes, pa.array(values.tolist(), pa.string())).cast(pa.string())
+                for column, (values, codes) in ((column, _encoded(chunk, column)) for column in columns)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+
+# Порции в виде pandas.DataFrame - для обучения без промежуточного файла (streaming.ChunkSource)
+def iter_frames(chunks, columns):
+    import pandas as pd
+
+    for chunk in chunks:
+        frame = {}
+        for column in columns:
+            if column == WEIGHT_COLUMN:
+                frame[column] = chunk.weights
+            else:
+                values, codes = _encoded(chunk, column)
+                frame[column] = values[codes]
+        yield pd.DataFrame(frame)
+
+
+WRITERS = {
+    "csv": write_csv,
+    "json": write_json,
+    "jsonl": write_jsonl,
+    "parquet": write_parquet,
+}
+
+
+def generate_dataset(knowledge_file, num_samples_per_type, output_file, output_format="csv",
+                     seed=None, chunk_size=CHUNK_SIZE, workers=1, mode="full"):
+    writer = WRITERS.get(output_format)
+    if writer is None:
         print(f"Error: Unsupported output format '{output_format}'.")
+        return
 
+    knowledge = load_knowledge(knowledge_file)
+    chunks = iter_dataset_chunks(knowledge, num_samples_per_type, chunk_size, seed, workers, mode)
+    writer(chunks, output_file, dataset_columns(knowledge, mode))
 
 
 knowledge_data = {
@@ -338,12 +523,39 @@ knowledge_data = {
     }
 }
 
-with open('knowledge.json', 'w', encoding='utf-8') as f:
-    json.dump(knowledge_data, f, indent=4, ensure_ascii=False)
+def main():
+    parser = argparse.ArgumentParser(description="Генерация обучающей выборки по базе знаний")
+    parser.add_argument("--knowledge", help="файл базы знаний; по умолчанию встроенная база записывается в knowledge.json")
+    parser.add_argument("--samples-per-type", type=int, default=10000)
+    parser.add_argument("--output", default="dataset.csv")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=1, help="число процессов для генерации")
+    parser.add_argument("--mode", choices=MODES, default="full",
+                        help="compact - различные строки с числом повторений в столбце 'вес'")
+    args = parser.parse_args()
+    # pyarrow нужен только для parquet; без него генерация упала бы лишь при записи первой порции
+    if args.format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        parser.error("для --format parquet нужен пакет pyarrow (pip install pyarrow)")
+
+    knowledge_file = args.knowledge
+    if knowledge_file is None:
+        knowledge_file = "knowledge.json"
+        with open(knowledge_file, 'w', encoding='utf-8') as f:
+            json.dump(knowledge_data, f, indent=4, ensure_ascii=False)
+
+    generate_dataset(
+        knowledge_file=knowledge_file,
+        num_samples_per_type=args.samples_per_type,
+        output_file=args.output,
+        output_format=args.format,
+        seed=args.seed,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        mode=args.mode,
+    )
+
 
-generate_dataset(
-    knowledge_file="knowledge.json",
-    num_samples_per_type=10000,
-    output_file="dataset.csv",
-    output_format="csv"
-)
+if __name__ == "__main__":
+    main()
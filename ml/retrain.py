@@ -0,0 +1,216 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import numpy as np
+from sqlalchemy import select
+
+ML_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(ML_DIR, "..", "backend")
+sys.path.append(BACKEND_DIR)
+import artifacts
+import migrations
+import models
+from database import build_engine, read_transaction
+from gen_file import CHUNK_SIZE, MODES, dataset_columns, iter_dataset_chunks, iter_frames, resolve_sources
+
+DEFAULT_DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{os.path.join(BACKEND_DIR, 'knowledge.db')}")
+# Отпечатки типов, по которым обучены артефакты каталога; по ним определяются изменившиеся типы
+MANIFEST_FILE = "retrain_manifest.json"
+
+
+def _grouped(rows):
+    grouped = {}
+    for key, value in rows:
+        grouped.setdefault(key, {})[value] = None
+    return {key: list(values) for key, values in grouped.items()}
+
+
+# Снимок базы знаний в формате knowledge.json, прочитанный пятью запросами.
+# Имена свойств приводятся к нижнему регистру, как в RuleIndex и в запросах /classify-ai.
+# База в старом формате сначала переводится в текущий, как при старте сервера.
+def load_knowledge_from_db(url):
+    engine = build_engine(url)
+    try:
+        migrations.migrate(engine)
+        with read_transaction(engine) as connection:
+            types = connection.execute(select(models.Type.name).order_by(models.Type.id)).scalars().all()
+            properties = connection.execute(
+                select(models.Property.name).order_by(models.Property.id)
+            ).scalars().all()
+            possible_values = connection.execute(
+                select(models.PossibleValue.property_name, models.PossibleValue.value).order_by(models.PossibleValue.id)
+            ).all()
+            type_properties = connection.execute(
+                select(models.TypeProperty.type_name, models.TypeProperty.property_name)
+                .order_by(models.TypeProperty.id)
+            ).all()
+            property_values = connection.execute(
+                select(models.Type.name, models.Property.name, models.PropertyValue.value)
+                .select_from(models.PropertyValue)
+                .join(models.Type, models.Type.id == models.PropertyValue.type_id)
+                .join(models.Property, models.Property.id == models.PropertyValue.property_id)
+                .order_by(models.PropertyValue.id)
+            ).all()
+    finally:
+        engine.dispose()
+
+    return {
+        "types": list(types),
+        "properties": list(dict.fromkeys(name.lower() for name in properties)),
+        "possible_values": _grouped((prop_name.lower(), value) for prop_name, value in possible_values),
+        "type_properties": _grouped((type_name, prop_name.lower()) for type_name, prop_name in type_properties),
+        "property_values": _grouped(
+            (f"{type_name}_{prop_name.lower()}", value) for type_name, prop_name, value in property_values
+        ),
+    }
+
+
+# Seed выборки типа выводится из общего seed и имени типа, а не из номера типа в базе знаний:
+# добавление, удаление или переименование других типов не меняет его строк
+def type_seed(seed, type_name):
+    return int(hashlib.sha1(f"{seed}:{type_name}".encode("utf-8")).hexdigest()[:16], 16)
+
+
+# Отпечаток выборки типа: его свойства с выбранными для них значениями и параметры генерации
+# (включая seed). Строки типа определяются только этим, поэтому по совпадению отпечатка
+# видно, что тип не изменился с прошлого обучения.
+def type_fingerprint(knowledge, type_name, params):
+    sources = [(prop_name, values.tolist()) for prop_name, values in resolve_sources(knowledge, type_name, warn=False)]
+    payload = json.dumps([type_name, sources, params], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+# Выборка генерируется в памяти при каждом проходе обучения и на диск не пишется. Каждый тип
+# генерируется отдельно со своим seed (type_seed), поэтому его строки одинаковы во всех проходах
+# и запусках, пока не изменился его отпечаток.
+def iter_type_frames(knowledge, type_names, params, workers):
+    columns = dataset_columns(knowledge, params["mode"])
+    for type_name in type_names:
+        chunks = iter_dataset_chunks(dict(knowledge, types=[type_name]), params["samples_per_type"],
+                                     params["chunk_size"], type_seed(params["seed"], type_name), workers,
+                                     params["mode"])
+        yield from iter_frames(chunks, columns)
+
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"models": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _changed_types(fingerprints, trained):
+    changed = [type_name for type_name, fingerprint in fingerprints.items() if trained.get(type_name) != fingerprint]
+    removed = [type_name for type_name in trained if type_name not in fingerprints]
+    return changed, removed
+
+
+# Переобучение одной командой: снимок базы знаний -> выборки типов -> потоковое обучение.
+# Изменившиеся типы определяются по отпечаткам из манифеста прежней версии. Если прежняя сеть есть
+# и изменилась часть типов, она дообучается (save_AI.train_streaming с previous и replay):
+# на всех строках изменившихся типов и на доле --replay строк остальных, за --incremental-epochs эпох.
+# RandomForest обучается заново целиком - на компактной выборке это секунды.
+# Артефакты записываются в новую версию (artifacts.create_version) и публикуются заменой
+# ML_DIR/CURRENT только после успешного обучения; сервер подхватывает её без перезапуска.
+def main():
+    parser = argparse.ArgumentParser(description="Переобучение модели по текущей базе знаний")
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL)
+    parser.add_argument("--model", choices=("nn", "rf", "all"), default="nn")
+    parser.add_argument("--samples-per-type", type=int, default=10000)
+    parser.add_argument("--mode", choices=MODES, default="full",
+                        help="compact - различные строки с весами: меньше памяти и быстрее RandomForest")
+    parser.add_argument("--seed", type=int, default=None, help="по умолчанию - seed прошлого обучения")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--incremental-epochs", type=int, default=5)
+    parser.add_argument("--replay", type=float, default=0.3, help="доля строк неизменившихся типов при дообучении")
+    parser.add_argument("--full", action="store_true", help="обучить заново, даже если возможно дообучение")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--output-dir", default=ML_DIR, help="каталог версий артефактов (ML_DIR сервера)")
+    parser.add_argument("--keep-versions", type=int, default=5, help="сколько последних версий хранить")
+    parser.add_argument("--work-dir", default=None, help="каталог для временных файлов обучения нейросети")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    knowledge = load_knowledge_from_db(args.database_url)
+    print(f"Knowledge snapshot: {len(knowledge['types'])} types, {len(knowledge['properties'])} properties "
+          f"in {time.perf_counter() - started:.2f} s")
+
+    current_dir, current_version = artifacts.resolve(args.output_dir)
+    manifest = load_manifest(current_dir)
+    seed = args.seed if args.seed is not None else manifest.get("seed", np.random.SeedSequence().entropy)
+    print(f"Seed: {seed}")
+    # "sampling" входит в отпечатки: модели, обученные на выборках прежней схемы seed (по номеру типа),
+    # переобучаются полностью
+    params = {"samples_per_type": args.samples_per_type, "mode": args.mode, "seed": seed,
+              "chunk_size": args.chunk_size, "sampling": "type-seed"}
+    fingerprints = {
+        type_name: type_fingerprint(knowledge, type_name, params)
+        for type_name in knowledge["types"] if type_name in knowledge["type_properties"]
+    }
+
+    def make_chunks():
+        return iter_type_frames(knowledge, fingerprints, params, args.workers)
+
+    manifest["seed"] = seed
+    trained_models = {}
+    if args.model in ("rf", "all"):
+        changed, removed = _changed_types(fingerprints, manifest["models"].get("rf", {}))
+        if changed or removed or args.full:
+            trained_models["rf"] = None
+        else:
+            print("RandomForest: no knowledge changes since the last training")
+    if args.model in ("nn", "all"):
+        trained = manifest["models"].get("nn")
+        changed, removed = _changed_types(fingerprints, trained or {})
+        if trained is not None and not changed and not removed and not args.full:
+            print("Neural network: no knowledge changes since the last training")
+        elif trained is not None and len(changed) < len(fingerprints) and not args.full:
+            print(f"Neural network: fine-tuning for changed types {changed}, removed types {removed}")
+            trained_models["nn"] = {type_name: args.replay for type_name in fingerprints if type_name not in changed}
+        else:
+            trained_models["nn"] = None
+
+    if trained_models:
+        directory, version = artifacts.create_version(args.output_dir, current_dir,
+                                                      artifacts.ARTIFACT_FILES + (MANIFEST_FILE,))
+        try:
+            if "rf" in trained_models:
+                import save_model
+
+                save_model.save_artifacts(*save_model.train_streaming(make_chunks), directory)
+                manifest["models"]["rf"] = fingerprints
+            if "nn" in trained_models:
+                import save_AI
+
+                replay = trained_models["nn"]
+                previous = save_AI.load_artifacts(current_dir) if replay is not None else None
+                epochs = args.incremental_epochs if replay is not None else args.epochs
+                save_AI.save_artifacts(*save_AI.train_streaming(make_chunks, epochs, args.batch_size, args.work_dir,
+                                                                previous=previous, replay=replay), directory)
+                manifest["models"]["nn"] = fingerprints
+            save_manifest(directory, manifest)
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        artifacts.publish(args.output_dir, version)
+        artifacts.prune(args.output_dir, args.keep_versions)
+        print(f"Published version {version} (previous: {current_version or 'unversioned'})")
+    print(f"Retraining time: {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,61 +1,265 @@
-import pandas as pd
+import argparse
+import math
+import os
+import tempfile
+import time
+import numpy as np
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder, OneHotEncoder
-from sklearn.compose import ColumnTransformer
-from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import LabelEncoder
 from sklearn.metrics import accuracy_score, classification_report
 import joblib
 import tensorflow as tf
 from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense, Dropout
+from tensorflow.keras.layers import Dense, Dropout, Input
 from tensorflow.keras.utils import to_categorical
+from export_npz import export_keras_model
+from gen_file import TARGET_COLUMN
+from save_model import build_preprocessor, load_dataset, split_weighted, split_weights
+import streaming
 
-data = pd.read_csv("dataset.csv")
 
-data = data.fillna("")
+def build_model(input_dim, num_classes, sparse=False):
+    model = Sequential([
+        Input(shape=(input_dim,), sparse=sparse),
+        Dense(128, activation='relu'),
+        Dropout(0.2),
+        Dense(64, activation='relu'),
+        Dropout(0.2),
+        Dense(32, activation='relu'),
+        Dense(num_classes, activation='softmax')
+    ])
+    model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    return model
 
-categorical_features = ['коллекция', 'внешний вид', 'категория', 'редкость', 'цвет', 'турнир']
 
-preprocessor = ColumnTransformer(
-    transformers=[
-        ('cat', OneHotEncoder(handle_unknown='ignore'), categorical_features),
-    ],
-    remainder='passthrough'
-)
+# Пакеты компактной выборки: строки выбираются с возвращением с вероятностью, пропорциональной весу.
+# Эпоха - столько выбранных строк, сколько повторений в выборке (steps_per_epoch в train), поэтому
+# число шагов оптимизатора и состав пакетов те же, что у полной выборки, даже если различных строк
+# всего десятки. Обучение по различным строкам с sample_weight делало бы один-два шага за эпоху.
+def _weighted_batches(X, y, weights, batch_size, seed=42):
+    sparse = hasattr(X, "tocsr")
+    if sparse:
+        X = X.tocsr()
+    cumulative = np.cumsum(weights)
+    rng = np.random.default_rng(seed)
+    while True:
+        rows = np.searchsorted(cumulative, rng.random(batch_size) * cumulative[-1], side='right')
+        yield (X[rows].toarray() if sparse else X[rows]), y[rows]
 
-X = data.drop('тип_предмета', axis=1)
-y = data['тип_предмета']
 
-label_encoder = LabelEncoder()
-y = label_encoder.fit_transform(y)
+# Для компактной выборки валидационная часть выделяется так же, как тестовая (split_weighted),
+# а её веса нормируются к среднему 1, чтобы масштаб функции потерь остался прежним.
+def train(data, epochs=20, batch_size=32, verbose=True):
+    data, weights = split_weights(data)
+    preprocessor = build_preprocessor()
 
-y = to_categorical(y)
+    X = data.drop(TARGET_COLUMN, axis=1)
+    y = data[TARGET_COLUMN]
 
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    label_encoder = LabelEncoder()
+    y = label_encoder.fit_transform(y)
 
-X_train = preprocessor.fit_transform(X_train)
-X_test = preprocessor.transform(X_test)
+    y = to_categorical(y)
 
-model = Sequential([
-    Dense(128, activation='relu', input_shape=(X_train.shape[1],)),
-    Dropout(0.2),
-    Dense(64, activation='relu'),
-    Dropout(0.2),
-    Dense(32, activation='relu'),
-    Dense(y_train.shape[1], activation='softmax')
-])
+    if weights is None:
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        w_test = None
+    else:
+        X_train, X_test, y_train, y_test, w_train, w_test = split_weighted(X, y, weights, 0.2, 42)
+        X_train, X_val, y_train, y_val, w_train, w_val = split_weighted(X_train, y_train, w_train, 0.2, 43)
 
-model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    X_train = preprocessor.fit_transform(X_train)
+    X_test = preprocessor.transform(X_test)
 
-history = model.fit(X_train, y_train, epochs=20, batch_size=32, validation_split=0.2)
+    model = build_model(X_train.shape[1], y_train.shape[1])
 
-y_pred = model.predict(X_test)
-y_pred_classes = y_pred.argmax(axis=1)
-y_test_classes = y_test.argmax(axis=1)
+    if weights is None:
+        model.fit(X_train, y_train, epochs=epochs, batch_size=batch_size, validation_split=0.2,
+                  verbose=1 if verbose else 0)
+    else:
+        model.fit(_weighted_batches(X_train, y_train, w_train, batch_size),
+                  steps_per_epoch=math.ceil(w_train.sum() / batch_size), epochs=epochs, shuffle=False,
+                  validation_data=(preprocessor.transform(X_val), y_val, w_val / w_val.mean()),
+                  verbose=1 if verbose else 0)
 
-print("Accuracy:", accuracy_score(y_test_classes, y_pred_classes))
-print(classification_report(y_test_classes, y_pred_classes))
+    if verbose:
+        y_pred = model.predict(X_test, verbose=0)
+        y_pred_classes = y_pred.argmax(axis=1)
+        y_test_classes = y_test.argmax(axis=1)
 
-model.save('neural_network_model_ai.h5')
-joblib.dump(label_encoder, 'label_encoder_ai.pkl')
-joblib.dump(preprocessor, 'preprocessor_ai.pkl')
\ No newline at end of file
+        print("Accuracy:", accuracy_score(y_test_classes, y_pred_classes, sample_weight=w_test))
+        print(classification_report(y_test_classes, y_pred_classes, sample_weight=w_test))
+
+    return model, label_encoder, preprocessor
+
+
+# Пакеты tf.data из файлов streaming.write_shards: индексы категорий превращаются
+# в разреженный one-hot прямо в конвейере, плотная матрица признаков не строится
+# class_weights - вес одного повторения строки каждого класса. С weighted=True строки выбираются
+# пропорционально весу (streaming.iter_weighted_batches), и каждая выбранная строка - одно повторение.
+def _sparse_dataset(shards, part, vocabulary, num_classes, batch_size, class_weights, rng=None, weighted=False):
+    offsets = tf.constant(vocabulary.offsets, dtype=tf.int64)
+    if weighted:
+        batch_source = lambda: streaming.iter_weighted_batches(shards, part, batch_size, rng)
+        batch_count = streaming.count_weighted_batches(shards, part, batch_size)
+    else:
+        batch_source = lambda: streaming.iter_batches(shards, part, batch_size, rng)
+        batch_count = streaming.count_batches(shards, part, batch_size)
+
+    def batches():
+        for codes, labels, counts in batch_source():
+            yield codes, labels, (counts * class_weights[labels]).astype(np.float32)
+
+    def to_sparse(codes, labels, weights):
+        present = tf.where(codes >= 0)
+        columns = tf.cast(tf.gather_nd(codes, present), tf.int64) + tf.gather(offsets, present[:, 1])
+        X = tf.SparseTensor(tf.stack([present[:, 0], columns], axis=1), tf.ones(tf.shape(columns), tf.float32),
+                            [tf.shape(codes, out_type=tf.int64)[0], vocabulary.width])
+        return X, tf.one_hot(labels, num_classes), weights
+
+    signature = (tf.TensorSpec((None, len(vocabulary.features)), tf.int32), tf.TensorSpec((None,), tf.int32),
+                 tf.TensorSpec((None,), tf.float32))
+    dataset = tf.data.Dataset.from_generator(batches, output_signature=signature).apply(
+        tf.data.experimental.assert_cardinality(batch_count))
+    return dataset.map(to_sparse).prefetch(tf.data.AUTOTUNE)
+
+
+# Потоковый режим: словарь признаков строится за один проход по порциям из make_chunks
+# (см. streaming.ChunkSource), затем строки кодируются во временные файлы перемешивания,
+# и сеть обучается по ним разреженными пакетами.
+# Пиковая память определяется размером порции и файла перемешивания, а не размером выборки.
+# Дообучение: previous - прежние (model, label_encoder, preprocessor), с которых начинается обучение;
+# replay - доли строк неизменившихся классов. Их строки прореживаются (streaming.thin),
+# а вес повторения увеличивается в 1 / доля, чтобы не сместить априорные вероятности классов.
+def train_streaming(make_chunks, epochs=20, batch_size=32, work_dir=None, verbose=True, previous=None, replay=None):
+    started = time.perf_counter()
+    vocabulary = streaming.fit_vocabulary(make_chunks())
+    streaming.report_rate("Vocabulary pass", vocabulary.rows, started)
+    classes = vocabulary.label_encoder.classes_
+    num_classes = len(classes)
+    replay = replay or {}
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as directory:
+        started = time.perf_counter()
+        chunks = streaming.thin(make_chunks(), replay) if replay else make_chunks()
+        shards = streaming.write_shards(chunks, vocabulary, directory)
+        streaming.report_rate("Encoding pass", vocabulary.rows, started)
+
+        # Компактная выборка обучается выбором строк по весу, поэтому вес выбранной строки - только
+        # множитель прореживания; веса валидации нормируются к среднему 1, как в train
+        multipliers = np.array([1 / replay.get(name, 1.0) for name in classes])
+        validation_weights = multipliers * shards.rows["validation"] / max(shards.weights["validation"], 1)
+        if previous is None:
+            model = build_model(vocabulary.width, num_classes, sparse=True)
+        else:
+            model = warm_start_model(previous, vocabulary)
+
+        started = time.perf_counter()
+        model.fit(_sparse_dataset(shards, "train", vocabulary, num_classes, batch_size, multipliers,
+                                  np.random.default_rng(42), weighted=shards.weighted("train")),
+                  validation_data=_sparse_dataset(shards, "validation", vocabulary, num_classes, batch_size,
+                                                  validation_weights),
+                  epochs=epochs, shuffle=False, verbose=2 if verbose else 0)
+        streaming.report_rate("Training", shards.weights["train"] * epochs, started)
+
+        if verbose:
+            confusion = np.zeros((num_classes, num_classes))
+            for X, y, weights in _sparse_dataset(shards, "test", vocabulary, num_classes, 4096, multipliers):
+                y_pred_classes = model(X, training=False).numpy().argmax(axis=1)
+                np.add.at(confusion, (y.numpy().argmax(axis=1), y_pred_classes), weights.numpy())
+            y_test_classes, y_pred_classes = np.nonzero(confusion)
+            w_test = confusion[y_test_classes, y_pred_classes]
+
+            print("Accuracy:", accuracy_score(y_test_classes, y_pred_classes, sample_weight=w_test))
+            print(classification_report(y_test_classes, y_pred_classes, sample_weight=w_test))
+
+    return model, vocabulary.label_encoder, vocabulary.preprocessor
+
+
+def _one_hot_columns(preprocessor):
+    encoder = preprocessor.named_transformers_["cat"]
+    columns = {}
+    for feature, categories in zip(encoder.feature_names_in_, encoder.categories_):
+        for value in categories:
+            columns[(feature, value)] = len(columns)
+    return columns
+
+
+# Перенос весов прежней модели в модель для нового словаря: строки первого слоя сопоставляются
+# по паре (признак, значение), столбцы выходного слоя - по имени класса. Новые категории
+# и классы получают обычную начальную инициализацию, исчезнувшие отбрасываются.
+def warm_start_model(previous, vocabulary):
+    old_model, old_label_encoder, old_preprocessor = previous
+    classes = vocabulary.label_encoder.classes_
+    model = build_model(vocabulary.width, len(classes), sparse=True)
+
+    old_layers = [layer for layer in old_model.layers if layer.get_weights()]
+    new_layers = [layer for layer in model.layers if layer.get_weights()]
+    def hidden_shapes(layers):
+        return [[weights.shape for weights in layer.get_weights()] for layer in layers[1:-1]]
+
+    if len(old_layers) != len(new_layers) or hidden_shapes(old_layers) != hidden_shapes(new_layers):
+        raise ValueError("Previous model architecture does not match build_model")
+
+    old_columns = _one_hot_columns(old_preprocessor)
+    kernel, bias = new_layers[0].get_weights()
+    old_kernel, old_bias = old_layers[0].get_weights()
+    for key, column in _one_hot_columns(vocabulary.preprocessor).items():
+        if key in old_columns:
+            kernel[column] = old_kernel[old_columns[key]]
+    new_layers[0].set_weights([kernel, old_bias])
+
+    for old_layer, new_layer in zip(old_layers[1:-1], new_layers[1:-1]):
+        new_layer.set_weights(old_layer.get_weights())
+
+    old_classes = {name: position for position, name in enumerate(old_label_encoder.classes_)}
+    kernel, bias = new_layers[-1].get_weights()
+    old_kernel, old_bias = old_layers[-1].get_weights()
+    for position, name in enumerate(classes):
+        if name in old_classes:
+            kernel[:, position] = old_kernel[:, old_classes[name]]
+            bias[position] = old_bias[old_classes[name]]
+    new_layers[-1].set_weights([kernel, bias])
+    return model
+
+
+def load_artifacts(directory="."):
+    from tensorflow.keras.models import load_model
+
+    model = load_model(os.path.join(directory, 'neural_network_model_ai.h5'), compile=False)
+    label_encoder = joblib.load(os.path.join(directory, 'label_encoder_ai.pkl'))
+    preprocessor = joblib.load(os.path.join(directory, 'preprocessor_ai.pkl'))
+    return model, label_encoder, preprocessor
+
+
+def save_artifacts(model, label_encoder, preprocessor, directory="."):
+    model.save(os.path.join(directory, 'neural_network_model_ai.h5'))
+    export_keras_model(model, os.path.join(directory, 'neural_network_model_ai.npz'))
+    joblib.dump(label_encoder, os.path.join(directory, 'label_encoder_ai.pkl'))
+    joblib.dump(preprocessor, os.path.join(directory, 'preprocessor_ai.pkl'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обучение нейронной сети по выборке gen_file.py")
+    parser.add_argument("--dataset", default="dataset.csv")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--streaming", action="store_true", help="читать выборку порциями, не загружая её целиком")
+    parser.add_argument("--chunk-size", type=int, default=streaming.CHUNK_SIZE,
+                        help="строк в порции в потоковом режиме")
+    parser.add_argument("--work-dir", default=None, help="каталог для временных файлов потокового режима")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.streaming:
+        model, label_encoder, preprocessor = train_streaming(
+            lambda: streaming.read_chunks(args.dataset, args.chunk_size), args.epochs, args.batch_size, args.work_dir)
+    else:
+        model, label_encoder, preprocessor = train(load_dataset(args.dataset), args.epochs, args.batch_size)
+    print(f"Training time: {time.perf_counter() - started:.1f} s")
+
+    save_artifacts(model, label_encoder, preprocessor)
+
+
+if __name__ == "__main__":
+    main()
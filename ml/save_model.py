@@ -1,3 +1,7 @@
+import argparse
+import os
+import time
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder, OneHotEncoder
@@ -6,37 +10,139 @@ from sklearn.pipeline import Pipeline
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, classification_report
 import joblib
+from gen_file import TARGET_COLUMN, WEIGHT_COLUMN
 
-data = pd.read_csv("dataset.csv")
+categorical_features = ['коллекция', 'внешний вид', 'категория', 'редкость', 'цвет', 'турнир']
 
-data = data.fillna("")
 
-categorical_features = ['коллекция', 'внешний вид', 'категория', 'редкость', 'цвет', 'турнир']
+def load_dataset(path):
+    data = pd.read_csv(path)
+    return data.fillna("")
+
+
+# Выборка компактного режима gen_file.py содержит столбец 'вес' - он становится sample_weight
+def split_weights(data):
+    if WEIGHT_COLUMN not in data.columns:
+        return data, None
+    return data.drop(WEIGHT_COLUMN, axis=1), data[WEIGHT_COLUMN].to_numpy(dtype=float)
+
+
+# Разбиение взвешенной выборки, эквивалентное разбиению полной: повторения каждой строки
+# делятся биномиально, поэтому строка может попасть и в обучающую, и в тестовую часть.
+def split_weighted(X, y, weights, test_size, random_state):
+    counts = weights.astype(np.int64)
+    test_counts = np.random.default_rng(random_state).binomial(counts, test_size)
+    train_counts = counts - test_counts
+    train_mask, test_mask = train_counts > 0, test_counts > 0
+    return (X[train_mask], X[test_mask], y[train_mask], y[test_mask],
+            train_counts[train_mask].astype(float), test_counts[test_mask].astype(float))
+
+
+# Бутстрэп по различным строкам искажает доли классов в листьях: строка с большим весом
+# выпадает из дерева целиком. Вместо него каждое дерево обучается на весах Пуассона(вес),
+# что приближает бутстрэп полной выборки, где каждое повторение строки выбирается отдельно.
+def fit_weighted_forest(X, y, weights, random_state):
+    classifier = RandomForestClassifier(random_state=random_state, bootstrap=False, warm_start=True)
+    trees = classifier.n_estimators
+    rng = np.random.default_rng(random_state)
+    for n_estimators in range(1, trees + 1):
+        classifier.set_params(n_estimators=n_estimators)
+        classifier.fit(X, y, sample_weight=rng.poisson(weights).astype(float))
+    return classifier
+
+
+def build_preprocessor(features=None):
+    return ColumnTransformer(
+        transformers=[
+            ('cat', OneHotEncoder(handle_unknown='ignore'), features or categorical_features),
+        ],
+        remainder='passthrough'
+    )
+
+
+def train(data, verbose=True):
+    data, weights = split_weights(data)
+    preprocessor = build_preprocessor()
+
+    X = data.drop(TARGET_COLUMN, axis=1)
+    y = data[TARGET_COLUMN]
+
+    label_encoder = LabelEncoder()
+    y = label_encoder.fit_transform(y)
+
+    if weights is None:
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        w_test = None
+        model = Pipeline(steps=[('preprocessor', preprocessor),
+                                ('classifier', RandomForestClassifier(random_state=42))])
+        model.fit(X_train, y_train)
+    else:
+        X_train, X_test, y_train, y_test, w_train, w_test = split_weighted(X, y, weights, 0.2, 42)
+        classifier = fit_weighted_forest(preprocessor.fit_transform(X_train), y_train, w_train, 42)
+        model = Pipeline(steps=[('preprocessor', preprocessor), ('classifier', classifier)])
+
+    if verbose:
+        y_pred = model.predict(X_test)
+        print("Accuracy:", accuracy_score(y_test, y_pred, sample_weight=w_test))
+        print(classification_report(y_test, y_pred, sample_weight=w_test))
+
+    return model, label_encoder, preprocessor
+
+
+# Потоковый режим: порции из make_chunks (см. streaming.ChunkSource) агрегируются в различные
+# строки с весами, поэтому память ограничена числом различных строк, а не размером выборки
+def train_streaming(make_chunks, verbose=True):
+    import streaming
+
+    started = time.perf_counter()
+    vocabulary = streaming.fit_vocabulary(make_chunks())
+    streaming.report_rate("Vocabulary pass", vocabulary.rows, started)
+
+    started = time.perf_counter()
+    codes, y, counts = streaming.aggregate(make_chunks(), vocabulary)
+    streaming.report_rate("Aggregation pass", vocabulary.rows, started)
+
+    started = time.perf_counter()
+    X = streaming.to_sparse(codes, vocabulary)
+    X_train, X_test, y_train, y_test, w_train, w_test = split_weighted(X, y, counts.astype(float), 0.2, 42)
+    classifier = fit_weighted_forest(X_train, y_train, w_train, 42)
+    streaming.report_rate("Training", len(y_train), started)
+    model = Pipeline(steps=[('preprocessor', vocabulary.preprocessor), ('classifier', classifier)])
+
+    if verbose:
+        y_pred = classifier.predict(X_test)
+        print("Accuracy:", accuracy_score(y_test, y_pred, sample_weight=w_test))
+        print(classification_report(y_test, y_pred, sample_weight=w_test))
+
+    return model, vocabulary.label_encoder, vocabulary.preprocessor
+
 
-preprocessor = ColumnTransformer(
-    transformers=[
-        ('cat', OneHotEncoder(handle_unknown='ignore'), categorical_features),
-    ],
-    remainder='passthrough'
-)
+def save_artifacts(model, label_encoder, preprocessor, directory="."):
+    joblib.dump(model, os.path.join(directory, 'model.pkl'))
+    joblib.dump(label_encoder, os.path.join(directory, 'label_encoder.pkl'))
+    joblib.dump(preprocessor, os.path.join(directory, 'preprocessor.pkl'))
 
-X = data.drop('тип_предмета', axis=1)
-y = data['тип_предмета']
 
-label_encoder = LabelEncoder()
-y = label_encoder.fit_transform(y)
+def main():
+    parser = argparse.ArgumentParser(description="Обучение RandomForest по выборке gen_file.py")
+    parser.add_argument("--dataset", default="dataset.csv")
+    parser.add_argument("--streaming", action="store_true", help="читать выборку порциями, не загружая её целиком")
+    parser.add_argument("--chunk-size", type=int, default=None, help="строк в порции в потоковом режиме")
+    args = parser.parse_args()
 
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    started = time.perf_counter()
+    if args.streaming:
+        import streaming
 
-model = Pipeline(steps=[('preprocessor', preprocessor),
-                        ('classifier', RandomForestClassifier(random_state=42))])
+        chunk_size = args.chunk_size or streaming.CHUNK_SIZE
+        model, label_encoder, preprocessor = train_streaming(
+            lambda: streaming.read_chunks(args.dataset, chunk_size))
+    else:
+        model, label_encoder, preprocessor = train(load_dataset(args.dataset))
+    print(f"Training time: {time.perf_counter() - started:.1f} s")
 
-model.fit(X_train, y_train)
+    save_artifacts(model, label_encoder, preprocessor)
 
-y_pred = model.predict(X_test)
-print("Accuracy:", accuracy_score(y_test, y_pred))
-print(classification_report(y_test, y_pred))
 
-joblib.dump(model, 'model.pkl')
-joblib.dump(label_encoder, 'label_encoder.pkl')
-joblib.dump(preprocessor, 'preprocessor.pkl')
\ No newline at end of file
+if __name__ == "__main__":
+    main()
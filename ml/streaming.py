@@ -0,0 +1,236 @@
+import os
+import time
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Tuple
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from sklearn.preprocessing import LabelEncoder
+from gen_file import TARGET_COLUMN, WEIGHT_COLUMN
+from save_model import build_preprocessor
+
+# Строк в порции чтения CSV и примерно строк в одном файле перемешивания:
+# эти два числа, а не размер выборки, ограничивают пиковую память
+CHUNK_SIZE = 100000
+SHARD_ROWS = 1000000
+PARTS = ("train", "validation", "test")
+
+# Источник выборки для потокового обучения: каждый вызов заново отдаёт порции (pandas.DataFrame)
+# с теми же строками, например из CSV (read_chunks)
+ChunkSource = Callable[[], Iterable[pd.DataFrame]]
+
+
+class Vocabulary(NamedTuple):
+    preprocessor: object
+    label_encoder: LabelEncoder
+    rows: int
+
+    @property
+    def features(self) -> List[str]:
+        return list(self.preprocessor.named_transformers_["cat"].feature_names_in_)
+
+    @property
+    def categories(self) -> List[np.ndarray]:
+        return self.preprocessor.named_transformers_["cat"].categories_
+
+    # Смещение первого столбца каждого признака в one-hot векторе
+    @property
+    def offsets(self) -> np.ndarray:
+        sizes = [len(categories) for categories in self.categories]
+        return np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+
+    @property
+    def width(self) -> int:
+        return sum(len(categories) for categories in self.categories)
+
+
+# Строки закодированной части выборки: индексы категорий признаков, индекс класса и вес.
+# shard_weights - сумма весов каждого файла части, нужна для длины эпохи iter_weighted_batches.
+class Shards(NamedTuple):
+    columns: int
+    paths: dict
+    rows: dict
+    weights: dict
+    shard_weights: dict
+
+    # Есть ли в части строки с весом больше 1 (компактная выборка)
+    def weighted(self, part) -> bool:
+        return self.weights[part] > self.rows[part]
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    return pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size)
+
+
+def report_rate(stage, rows, started):
+    seconds = time.perf_counter() - started
+    print(f"{stage}: {rows} rows in {seconds:.1f} s ({rows / max(seconds, 1e-9):.0f} rows/s)")
+
+
+# Первый проход: множества значений признаков и классов. Признаки - все столбцы, кроме
+# класса и веса. OneHotEncoder обучается на кадре, где каждый столбец перечисляет свои значения,
+# поэтому категории совпадают с полученными при обучении на всей выборке в памяти.
+def fit_vocabulary(chunks: Iterable[pd.DataFrame]) -> Vocabulary:
+    values = {}
+    labels = set()
+    rows = 0
+    for chunk in chunks:
+        for column in chunk.columns:
+            if column not in (TARGET_COLUMN, WEIGHT_COLUMN):
+                values.setdefault(column, set()).update(chunk[column].unique())
+        labels.update(chunk[TARGET_COLUMN].unique())
+        rows += len(chunk)
+    if not rows:
+        raise ValueError("Dataset is empty")
+
+    width = max(len(feature_values) for feature_values in values.values())
+    frame = pd.DataFrame({
+        feature: np.resize(np.array(sorted(feature_values), dtype=object), width)
+        for feature, feature_values in values.items()
+    })
+    preprocessor = build_preprocessor(list(values)).fit(frame)
+    label_encoder = LabelEncoder().fit(np.array(sorted(labels), dtype=object))
+    return Vocabulary(preprocessor, label_encoder, rows)
+
+
+# Индексы категорий (-1 для неизвестного значения), индексы классов и веса строк порции
+def encode(chunk, vocabulary: Vocabulary) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    codes = np.stack([
+        pd.Categorical(chunk[feature], categories=categories).codes
+        for feature, categories in zip(vocabulary.features, vocabulary.categories)
+    ], axis=1).astype(np.int32)
+    labels = pd.Categorical(chunk[TARGET_COLUMN], categories=vocabulary.label_encoder.classes_).codes
+    if WEIGHT_COLUMN in chunk.columns:
+        counts = chunk[WEIGHT_COLUMN].to_numpy(dtype=np.int64)
+    else:
+        counts = np.ones(len(chunk), dtype=np.int64)
+    return codes, labels.astype(np.int32), counts
+
+
+# То же, что preprocessor.transform, но по уже вычисленным индексам категорий
+def to_sparse(codes: np.ndarray, vocabulary: Vocabulary) -> csr_matrix:
+    rows, features = np.nonzero(codes >= 0)
+    columns = codes[rows, features] + vocabulary.offsets[features]
+    return csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(codes), vocabulary.width))
+
+
+# Прореживание порций для дообучения: каждое повторение строки класса сохраняется
+# с вероятностью fractions[класс] (по умолчанию 1), остаток записывается в столбец веса
+def thin(chunks: Iterable[pd.DataFrame], fractions: dict, seed=42) -> Iterator[pd.DataFrame]:
+    rng = np.random.default_rng(seed)
+    for chunk in chunks:
+        if WEIGHT_COLUMN in chunk.columns:
+            counts = chunk[WEIGHT_COLUMN].to_numpy(dtype=np.int64)
+        else:
+            counts = np.ones(len(chunk), dtype=np.int64)
+        kept = rng.binomial(counts, chunk[TARGET_COLUMN].map(fractions).fillna(1.0).to_numpy(dtype=float))
+        mask = kept > 0
+        if mask.any():
+            yield chunk[mask].assign(**{WEIGHT_COLUMN: kept[mask]})
+
+
+# Повторения строки делятся биномиально, как в split_weighted: тест 20%, валидация 20% остатка
+def split_counts(counts: np.ndarray, rng) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    test = rng.binomial(counts, 0.2)
+    validation = rng.binomial(counts - test, 0.2)
+    return counts - test - validation, validation, test
+
+
+def _collapse(parts):
+    records = np.concatenate([part_records for part_records, _ in parts])
+    counts = np.concatenate([part_counts for _, part_counts in parts])
+    unique, inverse = np.unique(records, axis=0, return_inverse=True)
+    return unique, np.bincount(inverse.ravel(), weights=counts, minlength=len(unique)).astype(np.int64)
+
+
+# Агрегация выборки в различные строки с весами: память ограничена числом различных строк.
+# Накопленные порции схлопываются, когда их становится вдвое больше уже известных строк.
+def aggregate(chunks: Iterable[pd.DataFrame], vocabulary: Vocabulary) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    parts, pending_rows, unique_rows = [], 0, 0
+    for chunk in chunks:
+        codes, labels, counts = encode(chunk, vocabulary)
+        parts.append((np.column_stack([codes, labels]), counts))
+        pending_rows += len(counts)
+        if pending_rows > max(CHUNK_SIZE, 2 * unique_rows):
+            parts = [_collapse(parts)]
+            pending_rows = unique_rows = len(parts[0][1])
+    records, counts = _collapse(parts)
+    return records[:, :-1], records[:, -1], counts
+
+
+# Второй проход для нейросети: строки кодируются и раскладываются по частям выборки,
+# а внутри части - по случайному файлу, что даёт внешнее перемешивание
+# (gen_file.py пишет строки блоками по типам, и порядок файла для обучения не годится).
+def write_shards(chunks: Iterable[pd.DataFrame], vocabulary: Vocabulary, directory, seed=42) -> Shards:
+    columns = len(vocabulary.features) + 2
+    shard_count = max(1, -(-vocabulary.rows // SHARD_ROWS))
+    paths = {part: [os.path.join(directory, f"{part}_{index}.bin") for index in range(shard_count)] for part in PARTS}
+    handles = {part: [open(shard_path, "wb") for shard_path in paths[part]] for part in PARTS}
+    rows = dict.fromkeys(PARTS, 0)
+    weights = dict.fromkeys(PARTS, 0)
+    shard_weights = {part: np.zeros(shard_count, dtype=np.int64) for part in PARTS}
+    rng = np.random.default_rng(seed)
+    try:
+        for chunk in chunks:
+            codes, labels, counts = encode(chunk, vocabulary)
+            records = np.column_stack([codes, labels, counts.astype(np.int32)])
+            for part, part_counts in zip(PARTS, split_counts(counts, rng)):
+                mask = part_counts > 0
+                part_records = records[mask]
+                part_records[:, -1] = part_counts[mask]
+                rows[part] += len(part_records)
+                weights[part] += int(part_counts.sum())
+                target = rng.integers(shard_count, size=len(part_records))
+                np.add.at(shard_weights[part], target, part_counts[mask])
+                for index, handle in enumerate(handles[part]):
+                    part_records[target == index].tofile(handle)
+    finally:
+        for part_handles in handles.values():
+            for handle in part_handles:
+                handle.close()
+    return Shards(columns, paths, rows, weights, {part: shard_weights[part].tolist() for part in PARTS})
+
+
+# Число пакетов части по размерам файлов; нужно tf.data, чтобы знать длину эпохи заранее
+def count_batches(shards: Shards, part, batch_size) -> int:
+    rows = [os.path.getsize(shard_path) // (4 * shards.columns) for shard_path in shards.paths[part]]
+    return sum(-(-shard_rows // batch_size) for shard_rows in rows)
+
+
+# Пакеты (индексы категорий, индексы классов, веса); в памяти одновременно только один файл.
+# С генератором rng порядок файлов и строк внутри файла перемешивается.
+def iter_batches(shards: Shards, part, batch_size, rng=None) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    paths = shards.paths[part]
+    for shard_path in (paths if rng is None else rng.permutation(paths)):
+        records = np.fromfile(shard_path, dtype=np.int32).reshape(-1, shards.columns)
+        if rng is not None:
+            records = records[rng.permutation(len(records))]
+        for start in range(0, len(records), batch_size):
+            batch = records[start:start + batch_size]
+            yield batch[:, :-2], batch[:, -2], batch[:, -1]
+
+
+# Число пакетов части для iter_weighted_batches: в каждом файле выбирается столько строк, сколько в нём повторений
+def count_weighted_batches(shards: Shards, part, batch_size) -> int:
+    return sum(-(-weight // batch_size) for weight in shards.shard_weights[part])
+
+
+# Пакеты компактной части выборки (индексы категорий, индексы классов, единичные веса): строки файла
+# выбираются с возвращением с вероятностью, пропорциональной весу, и из каждого файла выбирается
+# столько строк, сколько в нём повторений. Эпоха по числу шагов и составу пакетов та же, что
+# у полной выборки, даже если различных строк всего десятки; в памяти - один файл и блок выбранных строк.
+def iter_weighted_batches(shards: Shards, part, batch_size, rng) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    paths = shards.paths[part]
+    block = batch_size * 1024
+    for index in rng.permutation(len(paths)):
+        remaining = shards.shard_weights[part][index]
+        if not remaining:
+            continue
+        records = np.fromfile(paths[index], dtype=np.int32).reshape(-1, shards.columns)
+        cumulative = np.cumsum(records[:, -1], dtype=np.int64)
+        while remaining > 0:
+            size = min(remaining, block)
+            drawn = records[np.searchsorted(cumulative, rng.integers(cumulative[-1], size=size), side="right")]
+            for start in range(0, size, batch_size):
+                batch = drawn[start:start + batch_size]
+                yield batch[:, :-2], batch[:, -2], np.ones(len(batch), dtype=np.int32)
+            remaining -= size